@@ -0,0 +1,185 @@
+"""
+Microbenchmarks of the estimation path.
+
+Runs offline against SQLite and reports ops/sec, p50/p99 latency and SQL
+statements per call for each calc_* rule and the /api/times handlers,
+including a 9000 point sweep.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.2
+
+With --baseline the run fails (exit code 1) if any benchmark is slower, or
+issues more SQL statements per call, than the baseline allows.
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import jwt
+from sqlalchemy import event
+from main import create_app, db, seed, calc_arriendo, calc_diseno, calc_permisos, \
+    calc_licitacion, calc_construccion, calc_mudanza, calc_marcha_blanca
+
+BODY = {
+    'adm_agility': 'low',
+    'client_agility': 'normal',
+    'mun_agility': 'high',
+    'construction_mod': 'const_adm',
+    'constructions_times': 'daytime',
+    'procurement_process': 'direct',
+    'demolitions': 'yes',
+    'm2': 569.0
+}
+
+
+class StatementCounter:
+    """
+    Counts SQL statements run by an engine.
+    """
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(func, iterations: int, warmup: int, counter: StatementCounter) -> dict:
+    for _ in range(warmup):
+        func()
+
+    durations = []
+    statements = counter.count
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        func()
+        durations.append(time.perf_counter_ns() - start)
+    elapsed = time.perf_counter() - started
+    statements = counter.count - statements
+
+    durations.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / elapsed,
+        'p50_us': percentile(durations, 0.50) / 1000,
+        'p99_us': percentile(durations, 0.99) / 1000,
+        'sql_per_call': statements / iterations
+    }
+
+
+def benchmarks(client, headers: dict) -> dict:
+    def post(url, body=BODY):
+        def call():
+            rv = client.post(url, json=body, headers=headers)
+            assert rv.status_code == 200, rv.data
+        return call
+
+    def get_spec():
+        rv = client.get('/api/times/spec', headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+        assert rv.status_code == 200, rv.data
+
+    sweep = {'base': BODY, 'axes': {'adm_agility': None, 'construction_mod': None, 'demolitions': None,
+                                    'm2': {'start': 10, 'stop': 5000, 'step': 10}}}
+
+    return {
+        'calc_arriendo': calc_arriendo,
+        'calc_diseno': lambda: calc_diseno(1, BODY['m2']),
+        'calc_permisos': lambda: calc_permisos(6, 4),
+        'calc_licitacion': lambda: calc_licitacion(True),
+        'calc_construccion': lambda: calc_construccion(BODY['m2'], 'daytime', True, 'const_adm'),
+        'calc_mudanza': calc_mudanza,
+        'calc_marcha_blanca': lambda: calc_marcha_blanca(BODY['m2']),
+        'get_times': post('/api/times'),
+        'get_times_detailed': post('/api/times/detailed'),
+        'get_times_sweep': post('/api/times/sweep', sweep),
+        'get_times_fit': post('/api/times/fit', {'max_weeks': 45}),
+        'get_spec': get_spec,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Regressions of results against a baseline
+    return: list of messages, empty if there aren't regressions
+    """
+    regressions = []
+    for name, base in baseline['results'].items():
+        result = results.get(name)
+        if result is None:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['ops_per_sec']:.0f} ops/sec, "
+                               f"baseline {base['ops_per_sec']:.0f}")
+        if result['p99_us'] > base['p99_us'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_us']:.1f}us, baseline {base['p99_us']:.1f}us")
+        if result['sql_per_call'] > base['sql_per_call']:
+            regressions.append(f"{name}: {result['sql_per_call']:g} SQL statements per call, "
+                               f"baseline {base['sql_per_call']:g}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    # Background threads would add their statements to the SQL counts
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                      'OUTBOX_DISPATCHER_ENABLED': False, 'RULES_POLLING_ENABLED': False})
+    app.logger.setLevel(logging.WARNING)
+    with open('oauth-private.key', 'r') as f:
+        token = jwt.encode({'user_id': 1, 'aud': '1'}, f.read(), algorithm='RS256')
+    headers = {'Authorization': f'Bearer {token}'}
+
+    results = {}
+    with app.app_context():
+        db.create_all()
+        seed()
+        counter = StatementCounter(db.engine)
+        client = app.test_client()
+        for name, func in benchmarks(client, headers).items():
+            if args.filter not in name:
+                continue
+            results[name] = run(func, args.iterations, args.warmup, counter)
+            result = results[name]
+            print(f"{name:<22} {result['ops_per_sec']:>12.0f} ops/sec  p50 {result['p50_us']:>9.1f}us  "
+                  f"p99 {result['p99_us']:>9.1f}us  {result['sql_per_call']:>5g} sql/call")
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'iterations': args.iterations,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+In-process caches.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread safe, bounded LRU cache with an optional expiration per entry.
+
+    Attributes
+    ---
+    maxsize: max number of entries, the least recently used is evicted first
+    hits: lookups that found a live entry
+    misses: lookups that didn't
+    on_lookup: optional callback called with True on hits and False on misses
+    """
+
+    def __init__(self, maxsize: int = 1024, on_lookup=None):
+        self.maxsize = maxsize
+        self.on_lookup = on_lookup
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Value of a key, default if it isn't cached or it has expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    hit = True
+                else:
+                    del self._data[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                value = default
+                hit = False
+        if self.on_lookup is not None:
+            self.on_lookup(hit)
+        return value
+
+    def set(self, key, value, expires_at: float = None):
+        """
+        Cache a value.
+
+        expires_at: unix timestamp after which the entry is dropped, None to keep
+                    it until it is evicted
+        """
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every entry, stats are kept.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self._data),
+            'maxsize': self.maxsize
+        }
@@ -0,0 +1,29 @@
+import time
+import unittest
+from cache import LRUCache
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual({'hits': 3, 'misses': 1, 'hit_ratio': 0.75, 'size': 2, 'maxsize': 2},
+                         cache.stats())
+
+    def test_expiration(self):
+        cache = LRUCache()
+        cache.set('a', 1, expires_at=time.time() - 1)
+        cache.set('b', 2, expires_at=time.time() + 60)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(2, cache.get('b'))
+        self.assertEqual(1, len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
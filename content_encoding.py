@@ -0,0 +1,110 @@
+"""
+Negotiated response compression.
+
+Text responses (JSON, NDJSON, CSV) of at least COMPRESS_MIN_SIZE bytes are
+compressed with brotli or gzip, whichever the client prefers in
+Accept-Encoding. Brotli is used only when the `brotli` package is installed.
+Streamed responses are compressed chunk by chunk and flushed after each one,
+so clients still receive every chunk as it's produced. Compressed responses
+carry a weak ETag, which still matches If-None-Match. Views that negotiate
+their own encoding, like the precompressed spec, set `response.precompressed`
+so their representation and ETag are left as they are.
+"""
+import os
+import zlib
+from flask import Flask, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE = frozenset(['application/json', 'application/x-ndjson', 'text/csv'])
+
+
+class GzipStream:
+    def __init__(self, level: int):
+        # wbits 31 writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def encodings() -> list:
+    """
+    Encodings offered, in order of preference.
+    """
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compressor(app: Flask, encoding: str):
+    if encoding == 'br':
+        return BrotliStream(app.config['COMPRESS_BROTLI_QUALITY'])
+    return GzipStream(app.config['COMPRESS_GZIP_LEVEL'])
+
+
+def compress_stream(chunks, stream):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = stream.compress(chunk)
+            if data:
+                yield data
+        yield stream.finish()
+    finally:
+        # Lets a stream_with_context generator pop its context when the client goes away
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def init_app(app: Flask):
+    app.config.setdefault('COMPRESS_ENABLED', os.getenv('COMPRESS_ENABLED', 'true').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('COMPRESS_MIN_SIZE', int(os.getenv('COMPRESS_MIN_SIZE', 1024)))
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', int(os.getenv('COMPRESS_GZIP_LEVEL', 6)))
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', int(os.getenv('COMPRESS_BROTLI_QUALITY', 5)))
+
+    @app.after_request
+    def compress_response(response):
+        if not app.config['COMPRESS_ENABLED'] \
+                or response.status_code < 200 or response.status_code in (204, 206, 304) \
+                or response.mimetype not in COMPRESSIBLE \
+                or 'Content-Encoding' in response.headers \
+                or response.direct_passthrough \
+                or getattr(response, 'precompressed', False):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(encodings())
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, compressor(app, encoding))
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['COMPRESS_MIN_SIZE']:
+                return response
+            stream = compressor(app, encoding)
+            response.set_data(stream.compress(data) + stream.finish())
+        response.content_encoding = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            # Same content, different bytes
+            response.set_etag(etag, weak=True)
+        return response
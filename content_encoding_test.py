@@ -0,0 +1,63 @@
+import gzip
+import json
+import unittest
+from flask import Flask, Response, jsonify
+import content_encoding
+
+
+class ContentEncodingTestCase(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['COMPRESS_MIN_SIZE'] = 100
+        content_encoding.init_app(app)
+        self.rows = [{'id': i, 'weeks': 41} for i in range(100)]
+
+        @app.route('/small')
+        def small():
+            return jsonify({'weeks': 41})
+
+        @app.route('/large')
+        def large():
+            response = jsonify(self.rows)
+            response.add_etag()
+            return response
+
+        @app.route('/stream')
+        def stream():
+            return Response((f'{{"id":{i}}}\n' for i in range(100)), mimetype='application/x-ndjson')
+
+        self.client = app.test_client()
+
+    def test_negotiation(self):
+        rv = self.client.get('/large')
+        self.assertNotIn('Content-Encoding', rv.headers)
+        self.assertEqual('Accept-Encoding', rv.headers['Vary'])
+        etag = rv.headers['ETag']
+
+        rv = self.client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', rv.headers['Content-Encoding'])
+        self.assertEqual(self.rows, json.loads(gzip.decompress(rv.data)))
+        self.assertEqual(len(rv.data), int(rv.headers['Content-Length']))
+        self.assertEqual('W/' + etag, rv.headers['ETag'])
+
+        rv = self.client.get('/large', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', rv.headers)
+
+        rv = self.client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', rv.headers)
+
+    @unittest.skipIf(content_encoding.brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        rv = self.client.get('/large', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual('br', rv.headers['Content-Encoding'])
+        self.assertEqual(self.rows, json.loads(content_encoding.brotli.decompress(rv.data)))
+
+    def test_stream(self):
+        rv = self.client.get('/stream', headers={'Accept-Encoding': 'br;q=0, gzip'})
+        self.assertEqual('gzip', rv.headers['Content-Encoding'])
+        self.assertNotIn('Content-Length', rv.headers)
+        self.assertEqual(''.join(f'{{"id":{i}}}\n' for i in range(100)), gzip.decompress(rv.data).decode())
+
+
+if __name__ == '__main__':
+    unittest.main()
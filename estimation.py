@@ -0,0 +1,467 @@
+"""
+Estimation engine for the weeks to move.
+
+It doesn't depend on Flask nor SQLAlchemy. Every option combination and
+every m2 band is evaluated once when the engine is built, so answering an
+estimate is one band lookup plus one table index, and answering a batch is
+one searchsorted over the band edges plus one fancy index.
+"""
+import logging
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import product
+import numpy as np
+from constant import SubCategoryConstants, CategoryConstants
+
+logger = logging.getLogger(__name__)
+
+# Subcategories in Gantt order, with the category that owns them
+SUBCATEGORIES = (
+    (CategoryConstants.ARRIENDO, SubCategoryConstants.BUSQUEDA),
+    (CategoryConstants.ARRIENDO, SubCategoryConstants.NEGOCIACION_ARRIENDO),
+    (CategoryConstants.ARRIENDO, SubCategoryConstants.FIRMA_CONTRATO),
+    (CategoryConstants.DISENO, SubCategoryConstants.LEVANTAMIENTO_REQ),
+    (CategoryConstants.DISENO, SubCategoryConstants.DISENO_PRELIMINAR),
+    (CategoryConstants.DISENO, SubCategoryConstants.APROBACION_CLIENTE),
+    (CategoryConstants.DISENO, SubCategoryConstants.ANTEPROYECTO),
+    (CategoryConstants.DISENO, SubCategoryConstants.APROBACION_CLIENTE_2),
+    (CategoryConstants.DISENO, SubCategoryConstants.PROYECTO_EJECUTIVO),
+    (CategoryConstants.PERMISOS, SubCategoryConstants.PRESENTACION_MUNICIPAL),
+    (CategoryConstants.PERMISOS, SubCategoryConstants.PRES_ADM_EDIFICIO),
+    (CategoryConstants.LICITACION, SubCategoryConstants.LICITACION_OBRA),
+    (CategoryConstants.LICITACION, SubCategoryConstants.NEGOCIACION),
+    (CategoryConstants.LICITACION, SubCategoryConstants.ADJUDICACION_Y_FIRMA),
+    (CategoryConstants.CONSTRUCCION, SubCategoryConstants.CONSTRUCION),
+    (CategoryConstants.MUDANZA, SubCategoryConstants.LOGISTICA),
+    (CategoryConstants.MUDANZA, SubCategoryConstants.MUDANZA),
+    (CategoryConstants.OCUPACION, SubCategoryConstants.MARCHA_BLANCA),
+)
+SUBCATEGORY_CODES = tuple(code for _, code in SUBCATEGORIES)
+CATEGORIES = tuple(dict.fromkeys(category for category, _ in SUBCATEGORIES))
+
+# Enum fields of an estimate request, in table order
+FIELDS = ('adm_agility', 'client_agility', 'mun_agility', 'construction_mod',
+          'constructions_times', 'procurement_process', 'demolitions')
+
+# Valid options of each field. The index of an option is the code stored in the
+# database, options can only be appended.
+OPTIONS = {
+    'adm_agility': ('low', 'normal', 'high'),
+    'client_agility': ('low', 'normal', 'high'),
+    'mun_agility': ('low', 'normal', 'high'),
+    'construction_mod': ('const_adm', 'turnkey', 'general_contractor'),
+    'constructions_times': ('daytime', 'nightime', 'free'),
+    'procurement_process': ('direct', 'bidding'),
+    'demolitions': ('no', 'yes'),
+}
+
+# m2 ladders
+PROYECTO_EJECUTIVO = 'proyecto_ejecutivo'
+CONSTRUCCION = 'construccion'
+MARCHA_BLANCA = 'marcha_blanca'
+LADDERS = (PROYECTO_EJECUTIVO, CONSTRUCCION, MARCHA_BLANCA)
+
+# Subcategories with base weeks, the others come from ladders and factors
+BASE_WEEKS_CODES = (
+    SubCategoryConstants.BUSQUEDA,
+    SubCategoryConstants.NEGOCIACION_ARRIENDO,
+    SubCategoryConstants.FIRMA_CONTRATO,
+    SubCategoryConstants.LEVANTAMIENTO_REQ,
+    SubCategoryConstants.DISENO_PRELIMINAR,
+    SubCategoryConstants.APROBACION_CLIENTE,
+    SubCategoryConstants.ANTEPROYECTO,
+    SubCategoryConstants.APROBACION_CLIENTE_2,
+    SubCategoryConstants.LICITACION_OBRA,
+    SubCategoryConstants.NEGOCIACION,
+    SubCategoryConstants.ADJUDICACION_Y_FIRMA,
+    SubCategoryConstants.LOGISTICA,
+    SubCategoryConstants.MUDANZA,
+)
+
+Estimate = namedtuple('Estimate', ['weeks', 'subcategories'])
+
+# Callables called with (field, option) when an invalid option is replaced by its fallback
+fallback_listeners = []
+
+
+def warn_fallback(field: str, option):
+    logger.warning('%s is not a valid %s', option, field)
+    for listener in fallback_listeners:
+        listener(field, option)
+
+
+def category_weeks(subcategories: tuple) -> dict:
+    """
+    Weeks of every category, from the weeks of every subcategory in SUBCATEGORIES order.
+    """
+    weeks = {}
+    for (category, _), subcategory_weeks in zip(SUBCATEGORIES, subcategories):
+        weeks[category] = weeks.get(category, 0) + subcategory_weeks
+    return weeks
+
+
+class Rules:
+    """
+    Scheduling rules.
+
+    Attributes
+    ---
+    factors: field -> {option: value}, value used in the formulas for each option
+    fallbacks: field -> value used when the option isn't valid
+    bands: ladder -> (upper edges, weeks), a m2 value falls in the first
+           band whose upper edge is >= m2, or in the last one (no upper edge)
+    weeks: subcategory code -> base weeks
+    """
+
+    def __init__(self, factors: dict, fallbacks: dict, bands: dict, weeks: dict):
+        self.factors = factors
+        self.fallbacks = fallbacks
+        self.bands = bands
+        self.weeks = weeks
+
+    def factor(self, field: str, option):
+        """
+        Value of an option, or the field fallback if the option is invalid.
+        """
+        try:
+            return self.factors[field][option]
+        except (KeyError, TypeError):
+            warn_fallback(field, option)
+            return self.fallbacks[field]
+
+    def band_weeks(self, ladder: str, m2: float):
+        """
+        Weeks of the band of a ladder where m2 falls.
+        """
+        edges, weeks = self.bands[ladder]
+        return weeks[bisect_left(edges, m2)]
+
+    def validate(self):
+        """
+        Raise ValueError if a field, ladder or subcategory is missing, or a ladder is malformed.
+        Estimates must grow with m2 (EstimationEngine.fit relies on it): ladder weeks
+        can't decrease, and the factors scaling the construction ladder can't be negative.
+        """
+        for field in FIELDS:
+            if field not in self.factors or field not in self.fallbacks:
+                raise ValueError(f'{field} has no factors or fallback')
+            unknown = set(self.factors[field]) - set(OPTIONS[field])
+            if unknown:
+                raise ValueError(f'{field} has unknown options {sorted(unknown)}')
+        for ladder in LADDERS:
+            if ladder not in self.bands:
+                raise ValueError(f'{ladder} has no bands')
+            edges, weeks = self.bands[ladder]
+            if list(edges) != sorted(set(edges)) or len(weeks) != len(edges) + 1:
+                raise ValueError(f'{ladder} edges must be increasing, with one more weeks than edges')
+            if any(later < earlier for earlier, later in zip(weeks, weeks[1:])):
+                raise ValueError(f'{ladder} weeks must not decrease')
+        for field in ('constructions_times', 'construction_mod'):
+            if any(factor < 0 for factor in [*self.factors[field].values(), self.fallbacks[field]]):
+                raise ValueError(f'{field} factors must not be negative')
+        for code in BASE_WEEKS_CODES:
+            if code not in self.weeks:
+                raise ValueError(f'{code} has no weeks')
+
+    def to_dict(self) -> dict:
+        return {
+            'factors': {field: dict(options) for field, options in self.factors.items()},
+            'fallbacks': dict(self.fallbacks),
+            'bands': {ladder: {'edges': list(edges), 'weeks': list(weeks)}
+                      for ladder, (edges, weeks) in self.bands.items()},
+            'weeks': dict(self.weeks),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        Rules from the output of to_dict, validated.
+        """
+        try:
+            rules = cls(factors={field: dict(options) for field, options in data['factors'].items()},
+                        fallbacks=dict(data['fallbacks']),
+                        bands={ladder: (tuple(band['edges']), tuple(band['weeks']))
+                               for ladder, band in data['bands'].items()},
+                        weeks=dict(data['weeks']))
+        except (KeyError, TypeError, AttributeError) as exp:
+            raise ValueError(f'malformed rules {exp!r}') from exp
+        rules.validate()
+        return rules
+
+
+DEFAULT_RULES = Rules(
+    factors={
+        # Building administration agility, weeks to approve
+        'adm_agility': {'low': 6, 'normal': 4, 'high': 2},
+        # Client agility, weeks added to each design approval
+        'client_agility': {'high': 0, 'normal': 1, 'low': 2},
+        # Municipality agility, weeks to approve
+        'mun_agility': {'low': 8, 'normal': 6, 'high': 4},
+        # Construction mode, factor over construction weeks
+        'construction_mod': {'const_adm': 1.2, 'turnkey': 1, 'general_contractor': 1.2},
+        # Shift mode, factor over construction weeks
+        'constructions_times': {'daytime': 1, 'nightime': 1.3, 'free': 1},
+        # Procurement process, factor over bidding weeks
+        'procurement_process': {'direct': 0, 'bidding': 1},
+        # Demolitions, weeks added to construction
+        'demolitions': {'yes': 3, 'no': 0},
+    },
+    fallbacks={
+        'adm_agility': 0,
+        'client_agility': 0,
+        'mun_agility': 0,
+        'construction_mod': 1,
+        'constructions_times': 1,
+        'procurement_process': 1,
+        'demolitions': 0,
+    },
+    bands={
+        PROYECTO_EJECUTIVO: ((300, 600, 800, 1200, 1500, 2000, 2500, 3500),
+                             (4, 4, 5, 5, 6, 6, 7, 7, 8)),
+        CONSTRUCCION: ((300, 600, 800, 1200, 1500, 2000, 2500, 3500),
+                       (8, 9, 11, 13, 15, 17, 21, 24, 26)),
+        MARCHA_BLANCA: ((1000, 3500),
+                        (2, 3, 4)),
+    },
+    weeks={
+        SubCategoryConstants.BUSQUEDA: 2,
+        SubCategoryConstants.NEGOCIACION_ARRIENDO: 1,
+        SubCategoryConstants.FIRMA_CONTRATO: 0,
+        SubCategoryConstants.LEVANTAMIENTO_REQ: 1,
+        SubCategoryConstants.DISENO_PRELIMINAR: 4,
+        SubCategoryConstants.APROBACION_CLIENTE: 0,
+        SubCategoryConstants.ANTEPROYECTO: 4,
+        SubCategoryConstants.APROBACION_CLIENTE_2: 0,
+        SubCategoryConstants.LICITACION_OBRA: 4,
+        SubCategoryConstants.NEGOCIACION: 2,
+        SubCategoryConstants.ADJUDICACION_Y_FIRMA: 0,
+        SubCategoryConstants.LOGISTICA: 2,
+        SubCategoryConstants.MUDANZA: 0,
+    }
+)
+
+
+def subcategory_weeks(rules: Rules, factors: dict, ladders: dict) -> tuple:
+    """
+    Weeks of every subcategory, in SUBCATEGORIES order.
+
+    factors: field -> value already resolved for the options
+    ladders: ladder -> weeks already resolved for the m2
+    """
+    weeks = rules.weeks
+    client_agility = factors['client_agility']
+    procurement = factors['procurement_process']
+    construction = ladders[CONSTRUCCION] * factors['constructions_times'] * factors['construction_mod'] \
+        + factors['demolitions']
+
+    return (
+        weeks[SubCategoryConstants.BUSQUEDA],
+        weeks[SubCategoryConstants.NEGOCIACION_ARRIENDO],
+        weeks[SubCategoryConstants.FIRMA_CONTRATO],
+        weeks[SubCategoryConstants.LEVANTAMIENTO_REQ],
+        weeks[SubCategoryConstants.DISENO_PRELIMINAR] + client_agility,
+        weeks[SubCategoryConstants.APROBACION_CLIENTE],
+        weeks[SubCategoryConstants.ANTEPROYECTO] + client_agility,
+        weeks[SubCategoryConstants.APROBACION_CLIENTE_2],
+        ladders[PROYECTO_EJECUTIVO],
+        factors['mun_agility'],
+        factors['adm_agility'],
+        weeks[SubCategoryConstants.LICITACION_OBRA] * procurement,
+        weeks[SubCategoryConstants.NEGOCIACION] * procurement,
+        weeks[SubCategoryConstants.ADJUDICACION_Y_FIRMA],
+        construction,
+        weeks[SubCategoryConstants.LOGISTICA],
+        weeks[SubCategoryConstants.MUDANZA],
+        ladders[MARCHA_BLANCA],
+    )
+
+
+class EstimationEngine:
+    """
+    Precomputed estimates for every option combination and m2 band.
+
+    Options with the same value are collapsed into one level, invalid
+    options use the level of the field fallback. The m2 bands are the
+    union of the edges of every ladder.
+    """
+
+    def __init__(self, rules: Rules = DEFAULT_RULES):
+        self.rules = rules
+
+        # Levels per field: distinct values, option -> level
+        self.levels = {}
+        self.option_levels = {}
+        self.fallback_levels = {}
+        for field in FIELDS:
+            values = sorted(set(rules.factors[field].values()) | {rules.fallbacks[field]})
+            self.levels[field] = tuple(values)
+            self.option_levels[field] = {option: values.index(value)
+                                         for option, value in rules.factors[field].items()}
+            self.fallback_levels[field] = values.index(rules.fallbacks[field])
+
+        # Mixed radix strides to index combinations
+        self.strides = {}
+        stride = 1
+        for field in reversed(FIELDS):
+            self.strides[field] = stride
+            stride *= len(self.levels[field])
+        self.combinations = stride
+
+        self.edges = tuple(sorted({edge for edges, _ in rules.bands.values() for edge in edges}))
+        self.bands = len(self.edges) + 1
+
+        # Weeks of each ladder for every band
+        ladders_by_band = []
+        for band in range(self.bands):
+            ladders = {}
+            for ladder, (edges, weeks) in rules.bands.items():
+                ladder_band = bisect_left(edges, self.edges[band]) if band < len(self.edges) else len(edges)
+                ladders[ladder] = weeks[ladder_band]
+            ladders_by_band.append(ladders)
+
+        table = []
+        for levels in product(*(self.levels[field] for field in FIELDS)):
+            factors = dict(zip(FIELDS, levels))
+            for ladders in ladders_by_band:
+                subcategories = subcategory_weeks(rules, factors, ladders)
+                total = 0
+                for weeks in subcategories:
+                    total += weeks
+                table.append(Estimate(total, subcategories))
+        self.table = tuple(table)
+
+        # Same table as arrays, for batches
+        self.edges_array = np.array(self.edges, dtype=float)
+        self.totals = np.array([estimate.weeks for estimate in table], dtype=float) \
+            .reshape(self.combinations, self.bands)
+        subcategories = np.array([estimate.subcategories for estimate in table], dtype=float)
+        starts = [SUBCATEGORIES.index(next(item for item in SUBCATEGORIES if item[0] == category))
+                  for category in CATEGORIES]
+        self.category_totals = np.add.reduceat(subcategories, starts, axis=1) \
+            .reshape(self.combinations, self.bands, len(CATEGORIES))
+        # Every ladder grows with m2, so do the totals of every combination
+        self.monotone = bool(np.all(np.diff(self.totals, axis=1) >= 0))
+
+    def band(self, m2: float) -> int:
+        """
+        Band where m2 falls.
+        """
+        return bisect_left(self.edges, m2)
+
+    def bands_of(self, m2) -> np.ndarray:
+        """
+        Bands where each m2 of an array falls.
+        """
+        return np.searchsorted(self.edges_array, m2, side='left')
+
+    def combination(self, params: dict) -> int:
+        """
+        Index of the option combination of an estimate request.
+        """
+        index = 0
+        for field in FIELDS:
+            index += self.level(field, params[field]) * self.strides[field]
+        return index
+
+    def level(self, field: str, option) -> int:
+        """
+        Level of an option, the level of the field fallback if it isn't valid.
+        """
+        try:
+            return self.option_levels[field][option]
+        except (KeyError, TypeError):
+            warn_fallback(field, option)
+            return self.fallback_levels[field]
+
+    def key(self, params: dict) -> tuple:
+        """
+        Normalized (combination, band) of an estimate request.
+        """
+        return self.combination(params), self.band(params['m2'])
+
+    def lookup(self, combination: int, band: int) -> Estimate:
+        return self.table[combination * self.bands + band]
+
+    def estimate(self, params: dict) -> Estimate:
+        """
+        Estimate for a request with every field in FIELDS plus m2.
+        """
+        return self.lookup(*self.key(params))
+
+    def sweep(self, base: dict, axes: list, m2) -> np.ndarray:
+        """
+        Flat table indices (combination * bands + band) of every point of a
+        grid, in row major order, m2 varying fastest. Index `totals.ravel()`
+        or `category_totals.reshape(-1, len(CATEGORIES))` with them.
+
+        base: options of the fields that don't vary
+        axes: (field, options) for each field that varies
+        m2: m2 values
+        """
+        varied = {field for field, _ in axes}
+        combinations = np.array(sum(self.level(field, base[field]) * self.strides[field]
+                                    for field in FIELDS if field not in varied))
+        for field, options in axes:
+            levels = np.array([self.level(field, option) for option in options]) * self.strides[field]
+            combinations = np.add.outer(combinations, levels)
+        return np.add.outer(combinations * self.bands, self.bands_of(m2)).ravel()
+
+    def fit(self, max_weeks: float, fixed: dict) -> tuple:
+        """
+        Last band in which each option combination takes at most max_weeks.
+
+        Only the distinct levels of the fields that aren't fixed are searched,
+        options with the same level share the result. The totals of a
+        combination grow with the band, so the last band is found by a binary
+        search over the bands, run for every combination at once.
+
+        fixed: field -> option of the fields that don't vary
+        return: (axes, combinations, last bands), axes is (field, options) for
+                every field in FIELDS order, combinations and last bands are
+                arrays over the option grid, the last band is -1 if the
+                combination doesn't fit at any m2
+        """
+        if not self.monotone:
+            raise ValueError('totals must grow with m2')
+
+        axes = []
+        level_grid = np.zeros((), dtype=np.intp)
+        positions = []
+        for field in FIELDS:
+            options = [fixed[field]] if field in fixed else list(OPTIONS[field])
+            axes.append((field, options))
+            option_levels = [self.level(field, option) for option in options]
+            levels = sorted(set(option_levels))
+            positions.append([levels.index(level) for level in option_levels])
+            level_grid = np.add.outer(level_grid, np.array(levels) * self.strides[field])
+
+        # Count of bands that fit, first band that doesn't, for each level combination
+        rows = self.totals[level_grid.ravel()]
+        rows_index = np.arange(len(rows))
+        low = np.zeros(len(rows), dtype=np.intp)
+        high = np.full(len(rows), self.bands, dtype=np.intp)
+        while np.any(low < high):
+            middle = (low + high) // 2
+            searching = low < high
+            fits = rows[rows_index, np.minimum(middle, self.bands - 1)] <= max_weeks
+            low = np.where(searching & fits, middle + 1, low)
+            high = np.where(searching & ~fits, middle, high)
+        last_bands = (low - 1).reshape(level_grid.shape)[np.ix_(*positions)]
+        combinations = level_grid[np.ix_(*positions)]
+        return axes, combinations, last_bands
+
+    def band_edge(self, band: int):
+        """
+        Largest m2 of a band, None for the last band (no upper edge).
+        """
+        return self.edges[band] if band < len(self.edges) else None
+
+    def estimate_many(self, params_list: list) -> np.ndarray:
+        """
+        Total weeks for a list of estimate requests.
+        """
+        count = len(params_list)
+        combinations = np.fromiter((self.combination(params) for params in params_list),
+                                   dtype=np.intp, count=count)
+        m2 = np.fromiter((params['m2'] for params in params_list), dtype=float, count=count)
+        return self.totals[combinations, self.bands_of(m2)]
@@ -0,0 +1,78 @@
+import unittest
+from itertools import product
+from estimation import EstimationEngine, DEFAULT_RULES, OPTIONS, PROYECTO_EJECUTIVO, SUBCATEGORY_CODES, Rules, \
+    category_weeks
+from constant import SubCategoryConstants, CategoryConstants
+
+
+class EstimationEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = EstimationEngine()
+        self.params = {
+            'adm_agility': 'low',
+            'client_agility': 'normal',
+            'mun_agility': 'high',
+            'construction_mod': 'const_adm',
+            'constructions_times': 'daytime',
+            'procurement_process': 'direct',
+            'demolitions': 'yes',
+            'm2': 569.0
+        }
+
+    def test_estimate(self):
+        estimate = self.engine.estimate(self.params)
+        subcategories = dict(zip(SUBCATEGORY_CODES, estimate.subcategories))
+        self.assertEqual(5, subcategories[SubCategoryConstants.DISENO_PRELIMINAR])
+        self.assertEqual(4, subcategories[SubCategoryConstants.PROYECTO_EJECUTIVO])
+        self.assertEqual(9 * 1.2 + 3, subcategories[SubCategoryConstants.CONSTRUCION])
+        self.assertEqual(sum(estimate.subcategories), estimate.weeks)
+
+    def test_category_weeks(self):
+        estimate = self.engine.estimate(self.params)
+        weeks = category_weeks(estimate.subcategories)
+        self.assertEqual(9 * 1.2 + 3, weeks[CategoryConstants.CONSTRUCCION])
+        self.assertEqual(estimate.weeks, sum(weeks.values()))
+
+    def test_options(self):
+        for field, options in OPTIONS.items():
+            self.assertEqual(set(DEFAULT_RULES.factors[field]), set(options))
+
+    def test_fit(self):
+        axes, combinations, last_bands = self.engine.fit(41, {'demolitions': 'yes'})
+        self.assertEqual(('demolitions', ['yes']), axes[-1])
+        for point in product(*(range(len(options)) for _, options in axes)):
+            combination = self.engine.combination({field: options[position]
+                                                   for (field, options), position in zip(axes, point)})
+            self.assertEqual(combination, combinations[point])
+            fitting = [band for band in range(self.engine.bands) if self.engine.lookup(combination, band).weeks <= 41]
+            self.assertEqual(max(fitting, default=-1), last_bands[point])
+
+    def test_rules_dict(self):
+        rules = Rules.from_dict(DEFAULT_RULES.to_dict())
+        self.assertEqual(self.engine.estimate(self.params), EstimationEngine(rules).estimate(self.params))
+        data = DEFAULT_RULES.to_dict()
+        data['bands'][PROYECTO_EJECUTIVO]['weeks'] = [4]
+        self.assertRaises(ValueError, Rules.from_dict, data)
+
+        # Estimates must grow with m2
+        data = DEFAULT_RULES.to_dict()
+        data['bands'][PROYECTO_EJECUTIVO]['weeks'][-1] = 0
+        self.assertRaisesRegex(ValueError, 'must not decrease', Rules.from_dict, data)
+        data = DEFAULT_RULES.to_dict()
+        data['factors']['construction_mod']['turnkey'] = -1
+        self.assertRaisesRegex(ValueError, 'must not be negative', Rules.from_dict, data)
+
+    def test_bands(self):
+        self.assertEqual(self.engine.band(300), self.engine.band(0))
+        self.assertNotEqual(self.engine.band(300), self.engine.band(300.5))
+        self.assertEqual(self.engine.bands - 1, self.engine.band(10000))
+
+    def test_invalid_option(self):
+        self.params['client_agility'] = 'invalid'
+        invalid = self.engine.estimate(self.params)
+        self.params['client_agility'] = 'high'
+        self.assertEqual(self.engine.estimate(self.params), invalid)
+
+
+if __name__ == '__main__':
+    unittest.main()
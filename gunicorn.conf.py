@@ -0,0 +1,27 @@
+"""
+Gunicorn settings for the Times Service.
+
+GUNICORN_WORKER_CLASS=gevent serves each worker's requests as greenlets, so a
+request waiting on the projects module or the database doesn't block the
+others. The database driver must then be pure Python (DB_DRIVER=mysql+pymysql).
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8087')
+preload_app = True
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+# Concurrent requests per gevent worker
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+if worker_class == 'gevent':
+    # Patch before the app is preloaded, so its sockets, locks and threads cooperate
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def child_exit(server, worker):
+    # Drop the metrics of dead workers when collecting metrics across workers
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,36 @@
+import json
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from flask import Flask
+from json_provider import OrjsonProvider
+
+
+class OrjsonProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.json = OrjsonProvider(self.app)
+
+    def test_dumps(self):
+        value = {'b': Decimal('1.5'), 'a': datetime(2026, 1, 2), 'c': 'ñ'}
+        # Same content as the standard library provider
+        stdlib_app = Flask(__name__)
+        self.assertEqual(json.loads(stdlib_app.json.dumps(value)), json.loads(self.app.json.dumps(value)))
+        self.assertEqual('{"a":"Fri, 02 Jan 2026 00:00:00 GMT","b":"1.5","c":"ñ"}', self.app.json.dumps(value))
+        self.assertEqual('{"b":1,"a":2}', self.app.json.dumps({'b': 1, 'a': 2}, sort_keys=False))
+        self.assertEqual('{"1":2}', self.app.json.dumps({1: 2}))
+        # Beyond orjson
+        self.assertEqual('{"a": 1267650600228229401496703205376}', self.app.json.dumps({'a': 2 ** 100}))
+        with self.assertRaises(TypeError):
+            self.app.json.dumps({'a': object()})
+
+    def test_response(self):
+        with self.app.app_context():
+            rv = self.app.json.response(weeks=41)
+        self.assertEqual('application/json', rv.mimetype)
+        self.assertEqual(b'{"weeks":41}\n', rv.data)
+        self.assertEqual({'weeks': 41}, self.app.json.loads(rv.data))
+
+
+if __name__ == '__main__':
+    unittest.main()
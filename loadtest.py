@@ -0,0 +1,137 @@
+"""
+Load test of the serving mode.
+
+Starts a stub projects module that answers after --delay seconds, serves the
+app with gunicorn and gunicorn.conf.py against a temporary SQLite database,
+and sends --requests concurrent GET /api/times/saved/<id>, which wait on the
+projects module. Reports the achieved concurrency (requests * delay / elapsed)
+next to the worker count.
+
+    python loadtest.py --worker-class gevent --workers 1 --requests 200 --delay 0.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import jwt
+import requests
+
+
+def stub_projects_module(delay: float) -> ThreadingHTTPServer:
+    """
+    Projects module that answers every project, linked to time_gen 1, after `delay` seconds.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            project_id = self.path.rstrip('/').rsplit('/', 1)[-1]
+            body = json.dumps({'id': project_id, 'time_gen_id': 1}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def init_database(uri: str):
+    from main import TimeGen, create_app, db, seed, seed_rules, time_gen_values
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri})
+    with app.app_context():
+        db.create_all()
+        seed()
+        seed_rules()
+        db.session.add(TimeGen(id=1, **time_gen_values({
+            'adm_agility': 'low', 'client_agility': 'normal', 'mun_agility': 'high',
+            'construction_mod': 'const_adm', 'constructions_times': 'daytime',
+            'procurement_process': 'direct', 'demolitions': 'yes', 'm2': 569.0, 'weeks': 41})))
+        db.session.commit()
+
+
+def run(worker_class: str, workers: int, requests_count: int, delay: float, port: int = 8099,
+        concurrency: int = None) -> dict:
+    directory = os.path.dirname(os.path.abspath(__file__))
+    projects = stub_projects_module(delay)
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = 'sqlite:///' + os.path.join(tmp, 'loadtest.db')
+        init_database(uri)
+        env = dict(os.environ,
+                   SQLALCHEMY_DATABASE_URI=uri,
+                   PROJECTS_MODULE_HOST='127.0.0.1',
+                   PROJECTS_MODULE_PORT=str(projects.server_address[1]),
+                   GUNICORN_BIND=f'127.0.0.1:{port}',
+                   GUNICORN_WORKER_CLASS=worker_class,
+                   GUNICORN_WORKERS=str(workers),
+                   OUTBOX_DISPATCHER_ENABLED='false',
+                   LOG_LEVEL='WARNING')
+        env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'main:create_app()'],
+                                  cwd=directory, env=env, stderr=subprocess.DEVNULL)
+        try:
+            url = f'http://127.0.0.1:{port}/api/times'
+            for _ in range(100):
+                try:
+                    requests.get(f'{url}/metrics', timeout=1)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+
+            with open(os.path.join(directory, 'oauth-private.key')) as f:
+                token = jwt.encode({'user_id': 1, 'aud': '1'}, f.read(), algorithm='RS256')
+            headers = {'Authorization': f'Bearer {token}'}
+
+            def get(project_id):
+                return requests.get(f'{url}/saved/{project_id}', headers=headers, timeout=120).status_code
+
+            with ThreadPoolExecutor(max_workers=concurrency or requests_count) as executor:
+                started = time.perf_counter()
+                statuses = list(executor.map(get, range(requests_count)))
+                elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait()
+            projects.shutdown()
+
+    return {
+        'worker_class': worker_class,
+        'workers': workers,
+        'requests': requests_count,
+        'delay': delay,
+        'elapsed': elapsed,
+        'concurrency': requests_count * delay / elapsed,
+        'errors': sum(status != 200 for status in statuses)
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker-class', default=os.getenv('GUNICORN_WORKER_CLASS', 'gevent'))
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, help='client threads, --requests by default')
+    parser.add_argument('--delay', type=float, default=0.5, help='projects module latency in seconds')
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args(argv)
+
+    result = run(args.worker_class, args.workers, args.requests, args.delay, args.port, args.concurrency)
+    print(json.dumps(result, indent=2))
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
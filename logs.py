@@ -0,0 +1,112 @@
+"""
+Structured, non-blocking logging.
+
+Records are written as one JSON object per line. Request threads only put
+records in a queue, a QueueListener thread formats and writes them to
+stderr, so a slow log sink never blocks a request. Repeated records (same
+logger, level and message template) are rate limited.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most `burst` records per `interval` seconds for each
+    (logger, level, message template). The first record let through after
+    some were dropped carries their count in `suppressed`.
+    """
+
+    def __init__(self, burst: int = 10, interval: float = 60):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.interval:
+                started, count = now, 0
+            if count >= self.burst:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+            self._windows[key] = (started, count + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    QueueHandler for a queue that never leaves the process. Records are
+    queued untouched, formatting happens in the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging(level: str = None):
+    """
+    Route every record of the root logger through a queue to a JSON stderr handler.
+    The level comes from LOG_LEVEL (INFO by default). Safe to call more than once.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(burst=int(os.getenv('LOG_RATE_LIMIT_BURST', 10)),
+                                            interval=float(os.getenv('LOG_RATE_LIMIT_INTERVAL', 60))))
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    def start_listener():
+        global _listener
+        _listener = QueueListener(log_queue, stream_handler)
+        _listener.start()
+
+    start_listener()
+    atexit.register(lambda: _listener.stop())
+    # Threads don't survive fork, gunicorn workers forked from a preloaded app need their own
+    os.register_at_fork(after_in_child=start_listener)
@@ -0,0 +1,32 @@
+import json
+import logging
+import unittest
+from logs import JsonFormatter, RateLimitFilter
+
+
+def make_record(msg: str, *args) -> logging.LogRecord:
+    return logging.LogRecord('main', logging.WARNING, __file__, 1, msg, args, None)
+
+
+class LogsTestCase(unittest.TestCase):
+    def test_rate_limit(self):
+        rate_limit = RateLimitFilter(burst=2, interval=60)
+        allowed = [rate_limit.filter(make_record('%s is not a valid key', option))
+                   for option in ('a', 'b', 'c', 'd')]
+        self.assertEqual([True, True, False, False], allowed)
+        self.assertTrue(rate_limit.filter(make_record('another message')))
+
+        rate_limit.interval = 0
+        record = make_record('%s is not a valid key', 'e')
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(2, record.suppressed)
+
+    def test_json_formatter(self):
+        entry = json.loads(JsonFormatter().format(make_record('%s is not a valid key', 'low')))
+        self.assertEqual('low is not a valid key', entry['message'])
+        self.assertEqual('WARNING', entry['level'])
+        self.assertEqual('main', entry['logger'])
+
+
+if __name__ == '__main__':
+    unittest.main()
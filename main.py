@@ -1,17 +1,45 @@
+import csv
+import gzip
+import hashlib
+import io
 import jwt
+import math
 import os
 import logging
 import pprint
-from random import randrange
+import threading
+import time
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from constant import SubCategoryConstants, CategoryConstants
-import requests
+from cache import LRUCache
+from projects_client import ProjectsClient, ProjectsUnavailable
+import estimation
+import metrics
+import outbox
+from logs import configure_logging
+import profiling
+import content_encoding
+from json_provider import OrjsonProvider
+from estimation import EstimationEngine
+from poller import VersionPoller
 import json
-from sqlalchemy.exc import SQLAlchemyError
-from flask import Flask, jsonify, abort, request
+import numpy as np
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+import sqlalchemy
+from sqlalchemy import event, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session, joinedload, object_session, selectinload
+import click
+from flask import Blueprint, Flask, Response, current_app, jsonify, abort, request, stream_with_context
+from flask.cli import with_appcontext
+from flask.logging import default_handler
 from flask_sqlalchemy import SQLAlchemy
 from flask_swagger import swagger
 from flask_swagger_ui import get_swaggerui_blueprint
 from functools import wraps
+from itertools import islice
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 from flask_cors import CORS
@@ -23,41 +51,86 @@ DB_PASS = os.getenv('DB_PASSWORD', 'rac3e/07')
 DB_IP = os.getenv('DB_IP_ADDRESS', '10.2.19.195')
 DB_PORT = os.getenv('DB_PORT', '3307')
 DB_SCHEMA = os.getenv('DB_SCHEMA', 'wys')
+DB_DRIVER = os.getenv('DB_DRIVER', 'mysql')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
 APP_HOST = os.getenv('APP_HOST', '127.0.0.1')
 APP_PORT = os.getenv('APP_PORT', 5007)
 PROJECTS_MODULE_HOST = os.getenv('PROJECTS_MODULE_HOST', '127.0.0.1')
 PROJECTS_MODULE_PORT = os.getenv('PROJECTS_MODULE_PORT', 5000)
 PROJECTS_MODULE_API = os.getenv('PROJECTS_MODULE_API', '/api/projects/')
 PROJECTS_URL = f"http://{PROJECTS_MODULE_HOST}:{PROJECTS_MODULE_PORT}"
-app = Flask(__name__)
-CORS(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql://{DB_USER}:{DB_PASS}@{DB_IP}:{DB_PORT}/{DB_SCHEMA}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+PROJECTS_POOL_SIZE = int(os.getenv('PROJECTS_POOL_SIZE', 10))
+PROJECTS_CONNECT_TIMEOUT = float(os.getenv('PROJECTS_CONNECT_TIMEOUT', 2))
+PROJECTS_READ_TIMEOUT = float(os.getenv('PROJECTS_READ_TIMEOUT', 10))
+PROJECTS_RETRIES = int(os.getenv('PROJECTS_RETRIES', 3))
+PROJECTS_BACKOFF = float(os.getenv('PROJECTS_BACKOFF', 0.3))
+PROJECTS_FAILURE_THRESHOLD = int(os.getenv('PROJECTS_FAILURE_THRESHOLD', 5))
+PROJECTS_RESET_TIMEOUT = float(os.getenv('PROJECTS_RESET_TIMEOUT', 30))
+SAVED_BULK_MAX = int(os.getenv('SAVED_BULK_MAX', 200))
+OUTBOX_DISPATCHER_ENABLED = os.getenv('OUTBOX_DISPATCHER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+OUTBOX_INTERVAL = float(os.getenv('OUTBOX_INTERVAL', 1))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BACKOFF = float(os.getenv('OUTBOX_BACKOFF', 2))
+RULES_POLLING_ENABLED = os.getenv('RULES_POLLING_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RULES_POLL_INTERVAL = float(os.getenv('RULES_POLL_INTERVAL', 5))
+CATALOG_TTL = float(os.getenv('CATALOG_TTL', 300))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 4096))
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', 300))
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 8192))
+CALENDAR_CACHE_SIZE = int(os.getenv('CALENDAR_CACHE_SIZE', 256))
+WORKING_WEEK = os.getenv('WORKING_WEEK', '1111100')
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', 1000))
+SWEEP_MAX_POINTS = int(os.getenv('SWEEP_MAX_POINTS', 1000000))
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI',
+                                    f"{DB_DRIVER}://{DB_USER}:{DB_PASS}@{DB_IP}:{DB_PORT}/{DB_SCHEMA}")
+PUBLIC_KEY_FILE = os.getenv('PUBLIC_KEY_FILE', 'oauth-public.key')
 
 SWAGGER_URL = '/api/times/docs/'
 API_URL = '/api/times/spec'
-swaggerui_blueprint = get_swaggerui_blueprint(
-    SWAGGER_URL,
-    API_URL,
-    config={  # Swagger UI config overrides
-        'app_name': "WYS API - Times Service"
-    }
-)
 
-app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
+projects_client = ProjectsClient(f'{PROJECTS_URL}{PROJECTS_MODULE_API}',
+                                 pool_size=PROJECTS_POOL_SIZE,
+                                 connect_timeout=PROJECTS_CONNECT_TIMEOUT,
+                                 read_timeout=PROJECTS_READ_TIMEOUT,
+                                 retries=PROJECTS_RETRIES,
+                                 backoff_factor=PROJECTS_BACKOFF,
+                                 failure_threshold=PROJECTS_FAILURE_THRESHOLD,
+                                 reset_timeout=PROJECTS_RESET_TIMEOUT,
+                                 observer=metrics.observe_projects_call)
+projects_executor = ThreadPoolExecutor(max_workers=PROJECTS_POOL_SIZE, thread_name_prefix='projects')
+bp = Blueprint('times', __name__)
+estimation.fallback_listeners.append(metrics.count_enum_fallback)
+db = SQLAlchemy()
+Base = declarative_base()
 
-try:
-    f = open('oauth-public.key', 'r')
-    key: str = f.read()
-    f.close()
-    app.config['SECRET_KEY'] = key
-except Exception as terr:
-    app.logger.error(f'Can\'t read public key f{terr}')
-    exit(-1)
+class EnumCode(db.TypeDecorator):
+    """
+    Option of an enum field stored as its small integer code, the index of
+    the option in `options`.
+    """
+    impl = db.SmallInteger
+    cache_ok = True
+
+    def __init__(self, options: tuple):
+        super().__init__()
+        self.options = options
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return self.options.index(value)
+        except ValueError:
+            raise ValueError(f"{value} is not a valid option") from None
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.options[value]
 
-app.logger.setLevel(logging.DEBUG)
-db = SQLAlchemy(app)
-Base = declarative_base()
 
 class TimeGen(db.Model):
     """
@@ -72,17 +145,34 @@ class TimeGen(db.Model):
     procurement_process:  direct, bidding
     demolitions: yes, no
     "m2": 569.0
+    weeks: weeks to move
+    breakdown: category code -> estimated weeks
+    scenario_hash: hash of the options, m2 and weeks, rows are shared by every
+                   project that saves the same scenario and never updated
+
+    Options are stored as small integer codes (estimation.OPTIONS), in *_code columns.
     """
     id = db.Column(db.Integer, primary_key=True)
-    adm_agility = db.Column(db.String(45))
-    client_agility = db.Column(db.String(45))
-    mun_agility = db.Column(db.String(45))
-    construction_mod = db.Column(db.String(45))
-    constructions_times = db.Column(db.String(45))
-    procurement_process = db.Column(db.String(45))
-    demolitions = db.Column(db.String(45))
+    adm_agility = db.Column('adm_agility_code', EnumCode(estimation.OPTIONS['adm_agility']))
+    client_agility = db.Column('client_agility_code', EnumCode(estimation.OPTIONS['client_agility']))
+    mun_agility = db.Column('mun_agility_code', EnumCode(estimation.OPTIONS['mun_agility']))
+    construction_mod = db.Column('construction_mod_code', EnumCode(estimation.OPTIONS['construction_mod']))
+    constructions_times = db.Column('constructions_times_code', EnumCode(estimation.OPTIONS['constructions_times']))
+    procurement_process = db.Column('procurement_process_code', EnumCode(estimation.OPTIONS['procurement_process']))
+    demolitions = db.Column('demolitions_code', EnumCode(estimation.OPTIONS['demolitions']))
     m2 = db.Column(db.Float)
     weeks = db.Column(db.Float)
+    breakdown = db.Column(db.JSON)
+    scenario_hash = db.Column(db.String(64))
+
+    __table_args__ = (
+        db.Index('ux_time_gen_scenario_hash', 'scenario_hash', unique=True),
+        # Group by configuration, optionally within a m2 range
+        db.Index('ix_time_gen_configuration_m2', 'adm_agility_code', 'client_agility_code', 'mun_agility_code',
+                 'construction_mod_code', 'constructions_times_code', 'procurement_process_code',
+                 'demolitions_code', 'm2'),
+        db.Index('ix_time_gen_m2', 'm2'),
+    )
 
     def to_dict(self):
         """
@@ -98,7 +188,8 @@ class TimeGen(db.Model):
             'procurement_process': self.procurement_process,
             'demolitions': self.demolitions,
             'm2': self.m2,
-            'weeks': self.weeks
+            'weeks': self.weeks,
+            'breakdown': self.breakdown
         }
         return obj_dict
 
@@ -187,8 +278,119 @@ class TimeSubcategory(db.Model):
         return jsonify(self.to_dict())
 
 
-db.create_all()
-db.session.commit()
+class TimeRuleSet(db.Model):
+    """
+    Attributes
+    ---
+    id: Rule set id
+    version: Rule set version, workers use the highest one
+    created_at: Creation time, in UTC
+    factors: Value of each option and fallback of each field
+    bands: m2 bands of each ladder
+    weeks: Base weeks of each subcategory
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    factors = db.relationship("TimeRuleFactor", cascade="all, delete, delete-orphan")
+    bands = db.relationship("TimeRuleBand", cascade="all, delete, delete-orphan",
+                            order_by="TimeRuleBand.position")
+    weeks = db.relationship("TimeRuleWeeks", cascade="all, delete, delete-orphan")
+
+
+class TimeRuleFactor(db.Model):
+    """
+    Attributes
+    ---
+    id: Factor id
+    rule_set_id: Rule set that owns this factor
+    field: Enum field, adm_agility, construction_mod...
+    option: Option of the field, NULL for the value used when the option isn't valid
+    value: Value used in the formulas
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    rule_set_id = db.Column(db.Integer, db.ForeignKey('time_rule_set.id'), nullable=False)
+    field = db.Column(db.String(45), nullable=False)
+    option = db.Column(db.String(45))
+    value = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_time_rule_factor_rule_set_id', 'rule_set_id'),
+    )
+
+
+class TimeRuleBand(db.Model):
+    """
+    Attributes
+    ---
+    id: Band id
+    rule_set_id: Rule set that owns this band
+    ladder: proyecto_ejecutivo, construccion or marcha_blanca
+    position: Position of the band in its ladder
+    upper_edge: Largest m2 of the band, NULL for the last one
+    weeks: Weeks of the band
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    rule_set_id = db.Column(db.Integer, db.ForeignKey('time_rule_set.id'), nullable=False)
+    ladder = db.Column(db.String(45), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    upper_edge = db.Column(db.Float)
+    weeks = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_time_rule_band_rule_set_id', 'rule_set_id'),
+    )
+
+
+class TimeRuleWeeks(db.Model):
+    """
+    Attributes
+    ---
+    id: Weeks id
+    rule_set_id: Rule set that owns these weeks
+    subcategory_code: Subcategory Internal Name
+    weeks: Base weeks of the subcategory
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    rule_set_id = db.Column(db.Integer, db.ForeignKey('time_rule_set.id'), nullable=False)
+    subcategory_code = db.Column(db.String(100), nullable=False)
+    weeks = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_time_rule_weeks_rule_set_id', 'rule_set_id'),
+    )
+
+
+class ProjectUpdateOutbox(db.Model):
+    """
+    Attributes
+    ---
+    id: Outbox entry id
+    project_id: Project to update
+    time_gen_id: TimeGen to link to the project
+    token: Authorization header to call the projects module, dropped once done
+    status: pending, delivered, failed or superseded (a later entry updates the same project)
+    attempts: Delivery attempts
+    next_attempt_at: Next delivery attempt, in UTC
+    created_at: Creation time, in UTC
+    delivered_at: Delivery time, in UTC
+    error: Last delivery error
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, nullable=False)
+    time_gen_id = db.Column(db.Integer, db.ForeignKey('time_gen.id'), nullable=False)
+    token = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default=outbox.PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_project_update_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+        db.Index('ix_project_update_outbox_project_id', 'project_id'),
+    )
 
 
 def seed():
@@ -309,25 +511,225 @@ def seed():
         exit()
 
 
-db.create_all()
-seed()
+
+class TimeCatalog:
+    """
+    Process-wide, read-only snapshot of TimeCategory and TimeSubcategory.
+
+    The snapshot is loaded lazily with a single eager query, ordered by
+    position, and indexed by category code and subcategory code.
+    It is dropped by invalidate() (called automatically whenever this
+    process writes either table) or once it is older than `ttl` seconds,
+    so edits made from elsewhere show up without a restart.
+    """
+
+    def __init__(self, ttl: float = CATALOG_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self.version = 0
+
+    def invalidate(self):
+        """
+        Drop the current snapshot, next access reloads it.
+        """
+        with self._lock:
+            self._snapshot = None
+            self.version += 1
+
+    def _load(self):
+        categories = TimeCategory.query \
+            .options(joinedload(TimeCategory.subcategories)) \
+            .order_by(TimeCategory.position) \
+            .all()
+
+        by_category = {}
+        by_subcategory = {}
+        ordered = []
+        for category in categories:
+            category_dict = category.to_dict()
+            subcategories = tuple(
+                MappingProxyType(sub_cat)
+                for sub_cat in sorted(category_dict['subcategories'],
+                                      key=lambda sub_cat: sub_cat['position']))
+            category_dict['subcategories'] = subcategories
+            category_view = MappingProxyType(category_dict)
+            ordered.append(category_view)
+            by_category[category_view['code']] = category_view
+            for sub_cat in subcategories:
+                by_subcategory[sub_cat['code']] = sub_cat
+
+        return tuple(ordered), MappingProxyType(by_category), MappingProxyType(by_subcategory)
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or time.monotonic() - self._loaded_at >= self.ttl:
+                version = self.version
+                snapshot = self._load()
+                # Don't publish a snapshot that was invalidated while loading
+                if version == self.version:
+                    self._snapshot = snapshot
+                    self._loaded_at = time.monotonic()
+                return snapshot
+            return self._snapshot
+
+    def categories(self) -> tuple:
+        """
+        All categories ordered by position, with their subcategories.
+        """
+        return self._get_snapshot()[0]
+
+    def category(self, code: str):
+        """
+        Category (read-only mapping) by code, None if it doesn't exist.
+        """
+        return self._get_snapshot()[1].get(code)
+
+    def subcategory(self, code: str):
+        """
+        Subcategory (read-only mapping) by code, None if it doesn't exist.
+        """
+        return self._get_snapshot()[2].get(code)
+
+
+catalog = TimeCatalog()
+estimation_engine = EstimationEngine()
+# Serialized /api/times bodies by (engine, combination, m2 band)
+result_cache = LRUCache(maxsize=RESULT_CACHE_SIZE, on_lookup=metrics.cache_observer('result'))
+
+
+def set_estimation_rules(rules: estimation.Rules):
+    """
+    Swap the estimation engine for one built from new rules, and drop
+    every result cached with the previous rules. Requests that already
+    took the previous engine keep using it.
+    """
+    global estimation_engine
+    estimation_engine = EstimationEngine(rules)
+    result_cache.clear()
+
+
+def number(value: float):
+    """
+    int if the value is integral, so rules read from the database give the same results as the defaults
+    """
+    return int(value) if float(value).is_integer() else value
+
+
+def rules_from_rule_set(rule_set: TimeRuleSet) -> estimation.Rules:
+    """
+    Compile the rows of a rule set into Rules
+    """
+    factors = {}
+    fallbacks = {}
+    for factor in rule_set.factors:
+        if factor.option is None:
+            fallbacks[factor.field] = number(factor.value)
+        else:
+            factors.setdefault(factor.field, {})[factor.option] = number(factor.value)
+    ladders = {}
+    for band in rule_set.bands:
+        edges, weeks = ladders.setdefault(band.ladder, ([], []))
+        if band.upper_edge is not None:
+            edges.append(number(band.upper_edge))
+        weeks.append(number(band.weeks))
+    rules = estimation.Rules(factors=factors,
+                             fallbacks=fallbacks,
+                             bands={ladder: (tuple(edges), tuple(weeks)) for ladder, (edges, weeks) in ladders.items()},
+                             weeks={weeks.subcategory_code: number(weeks.weeks) for weeks in rule_set.weeks})
+    rules.validate()
+    return rules
+
+
+def latest_rules_version():
+    return db.session.query(db.func.max(TimeRuleSet.version)).scalar()
+
+
+def load_estimation_rules(version: int):
+    """
+    Compile a rule set version and swap the estimation engine for it
+    """
+    rule_set = TimeRuleSet.query \
+        .options(selectinload(TimeRuleSet.factors), selectinload(TimeRuleSet.bands), selectinload(TimeRuleSet.weeks)) \
+        .filter(TimeRuleSet.version == version) \
+        .one()
+    set_estimation_rules(rules_from_rule_set(rule_set))
+
+
+def publish_rules(rules: estimation.Rules) -> int:
+    """
+    Store rules as a new rule set version, workers load it on their next poll
+    return: version
+    """
+    rules.validate()
+    rule_set = TimeRuleSet(version=(latest_rules_version() or 0) + 1)
+    for field in estimation.FIELDS:
+        for option, value in rules.factors[field].items():
+            rule_set.factors.append(TimeRuleFactor(field=field, option=option, value=value))
+        rule_set.factors.append(TimeRuleFactor(field=field, option=None, value=rules.fallbacks[field]))
+    for ladder, (edges, weeks) in rules.bands.items():
+        for position, band_weeks in enumerate(weeks):
+            rule_set.bands.append(TimeRuleBand(ladder=ladder, position=position, weeks=band_weeks,
+                                               upper_edge=edges[position] if position < len(edges) else None))
+    for code, weeks in rules.weeks.items():
+        rule_set.weeks.append(TimeRuleWeeks(subcategory_code=code, weeks=weeks))
+    db.session.add(rule_set)
+    db.session.commit()
+    return rule_set.version
+
+
+def seed_rules():
+    """
+    Store the default rules as version 1, if there isn't any rule set.
+    """
+    if latest_rules_version() is None:
+        publish_rules(estimation.DEFAULT_RULES)
+
+
+rules_poller = VersionPoller(latest_rules_version, load_estimation_rules, interval=RULES_POLL_INTERVAL)
+
+
+@event.listens_for(TimeCategory, 'after_insert')
+@event.listens_for(TimeCategory, 'after_update')
+@event.listens_for(TimeCategory, 'after_delete')
+@event.listens_for(TimeSubcategory, 'after_insert')
+@event.listens_for(TimeSubcategory, 'after_update')
+@event.listens_for(TimeSubcategory, 'after_delete')
+def mark_catalog_dirty(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['catalog_dirty'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_catalog(session):
+    if session.info.pop('catalog_dirty', False):
+        catalog.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_catalog_dirty(session):
+    session.info.pop('catalog_dirty', None)
 
 
 def generate_dict(dict_values: dict, category_code: str):
-    category: TimeCategory = TimeCategory.query \
-        .filter(TimeCategory.code == category_code) \
-        .first()
+    category = catalog.category(category_code)
 
     if category is None:
         return {}
 
     # Build Dictionary
-    category_dict = category.to_dict()
+    category_dict = dict(category)
+    category_dict['subcategories'] = [dict(sub_cat) for sub_cat in category['subcategories']]
     sub_cat: dict
     for sub_cat in category_dict["subcategories"]:
         sub_cat_code = sub_cat['code']
         if sub_cat_code not in dict_values:
-            logging.warning(f'{sub_cat_code} is not a valid subcategory code')
+            logging.warning('%s is not a valid subcategory code', sub_cat_code)
             sub_cat['weeks'] = 0
         else:
             sub_cat['weeks'] = dict_values[sub_cat_code]
@@ -339,35 +741,19 @@ def calc_arriendo():
     Calc Arriendo Weeks
     return: Category dict corresponding to "Arriendo"
     """
+    weeks = estimation_engine.rules.weeks
 
     # Build dict with weeks by subcategories
-    dict_values = {SubCategoryConstants.BUSQUEDA: 2,
-                   SubCategoryConstants.NEGOCIACION_ARRIENDO: 1,
-                   SubCategoryConstants.FIRMA_CONTRATO: 0
+    dict_values = {SubCategoryConstants.BUSQUEDA: weeks[SubCategoryConstants.BUSQUEDA],
+                   SubCategoryConstants.NEGOCIACION_ARRIENDO: weeks[SubCategoryConstants.NEGOCIACION_ARRIENDO],
+                   SubCategoryConstants.FIRMA_CONTRATO: weeks[SubCategoryConstants.FIRMA_CONTRATO]
                    }
 
     return generate_dict(dict_values, CategoryConstants.ARRIENDO)
 
 
 def calc_proyecto_ejecutivo(m2):
-    if m2 <= 300:
-        return 4
-    elif 300 < m2 <= 600:
-        return 4
-    elif 600 < m2 <= 800:
-        return 5
-    elif 800 < m2 <= 1200:
-        return 5
-    elif 1200 < m2 <= 1500:
-        return 6
-    elif 1500 < m2 <= 2000:
-        return 6
-    elif 2000 < m2 <= 2500:
-        return 7
-    elif 2500 < m2 <= 3500:
-        return 7
-    else:
-        return 8
+    return estimation_engine.rules.band_weeks(estimation.PROYECTO_EJECUTIVO, m2)
 
 
 def calc_diseno(client_aprov: int, m2: float):
@@ -375,13 +761,15 @@ def calc_diseno(client_aprov: int, m2: float):
     Calc diseno category
     return: dict with durations.
     """
+    weeks = estimation_engine.rules.weeks
+
     # Build dict with subcategories durations in weeks
     dict_values = {
-        SubCategoryConstants.LEVANTAMIENTO_REQ: 1,
-        SubCategoryConstants.DISENO_PRELIMINAR: 4 + client_aprov,
-        SubCategoryConstants.APROBACION_CLIENTE: 0,
-        SubCategoryConstants.ANTEPROYECTO: 4 + client_aprov,
-        SubCategoryConstants.APROBACION_CLIENTE_2: 0,
+        SubCategoryConstants.LEVANTAMIENTO_REQ: weeks[SubCategoryConstants.LEVANTAMIENTO_REQ],
+        SubCategoryConstants.DISENO_PRELIMINAR: weeks[SubCategoryConstants.DISENO_PRELIMINAR] + client_aprov,
+        SubCategoryConstants.APROBACION_CLIENTE: weeks[SubCategoryConstants.APROBACION_CLIENTE],
+        SubCategoryConstants.ANTEPROYECTO: weeks[SubCategoryConstants.ANTEPROYECTO] + client_aprov,
+        SubCategoryConstants.APROBACION_CLIENTE_2: weeks[SubCategoryConstants.APROBACION_CLIENTE_2],
         SubCategoryConstants.PROYECTO_EJECUTIVO: calc_proyecto_ejecutivo(m2)
     }
 
@@ -389,24 +777,7 @@ def calc_diseno(client_aprov: int, m2: float):
 
 
 def calc_weeks_per_m2_construccion(m2: int):
-    if m2 <= 300:
-        return 8
-    elif 300 < m2 <= 600:
-        return 9
-    elif 600 < m2 <= 800:
-        return 11
-    elif 800 < m2 <= 1200:
-        return 13
-    elif 1200 < m2 <= 1500:
-        return 15
-    elif 1500 < m2 <= 2000:
-        return 17
-    elif 2000 < m2 <= 2500:
-        return 21
-    elif 2500 < m2 <= 3500:
-        return 24
-    else:
-        return 26
+    return estimation_engine.rules.band_weeks(estimation.CONSTRUCCION, m2)
 
 
 def calc_permisos(municipality_agility: int, building_agility: int):
@@ -426,49 +797,31 @@ def calc_licitacion(isDirect: bool):
     Calc licitacion category
     return: dict with durations
     """
+    rules = estimation_engine.rules
+    procurement = rules.factors['procurement_process']['direct' if isDirect else 'bidding']
     dict_values = {
-        SubCategoryConstants.LICITACION_OBRA: 0 if isDirect else 4,
-        SubCategoryConstants.NEGOCIACION: 0 if isDirect else 2,
-        SubCategoryConstants.ADJUDICACION_Y_FIRMA: 0
+        SubCategoryConstants.LICITACION_OBRA: rules.weeks[SubCategoryConstants.LICITACION_OBRA] * procurement,
+        SubCategoryConstants.NEGOCIACION: rules.weeks[SubCategoryConstants.NEGOCIACION] * procurement,
+        SubCategoryConstants.ADJUDICACION_Y_FIRMA: rules.weeks[SubCategoryConstants.ADJUDICACION_Y_FIRMA]
     }
     return generate_dict(dict_values, CategoryConstants.LICITACION)
 
 
 def calc_construccion(m2: int, shift: str, demolition_required: bool, construction_mod: str):
-    # Mapping Weeks
-    shift_map = {
-        'daytime': 1,
-        'nightime': 1.3,
-        'free': 1
-    }
-
-    construction_mod_map = {
-        'const_adm': 1.2,
-        'turnkey': 1,
-        'general_contractor': 1.2
-    }
+    rules = estimation_engine.rules
     weeks = {}
 
     # Weeks per m2
-
     weeks['m2'] = calc_weeks_per_m2_construccion(m2)
 
     # Shift Mode
-    if shift not in shift_map:
-        logging.warning(f'{shift} isn\'t a valid shift mode')
-        weeks['shift'] = 1
-    else:
-        weeks['shift'] = shift_map[shift]
+    weeks['shift'] = rules.factor('constructions_times', shift)
 
     # Demolition required
-    weeks['demolition'] = 3 if demolition_required else 0
+    weeks['demolition'] = rules.factors['demolitions']['yes' if demolition_required else 'no']
 
     # Construction Mode
-    if construction_mod not in construction_mod_map:
-        logging.warning(f'{construction_mod} isn\'t a valid procurement ')
-        weeks['const_mod'] = 1
-    else:
-        weeks['const_mod'] = construction_mod_map[construction_mod]
+    weeks['const_mod'] = rules.factor('construction_mod', construction_mod)
 
     total_weeks = (weeks['m2'] * weeks['shift'] * weeks['const_mod']) + weeks['demolition']
 
@@ -480,21 +833,16 @@ def calc_construccion(m2: int, shift: str, demolition_required: bool, constructi
 
 
 def calc_mudanza():
+    weeks = estimation_engine.rules.weeks
     dict_values = {
-        SubCategoryConstants.MUDANZA: 0,
-        SubCategoryConstants.LOGISTICA: 2
+        SubCategoryConstants.MUDANZA: weeks[SubCategoryConstants.MUDANZA],
+        SubCategoryConstants.LOGISTICA: weeks[SubCategoryConstants.LOGISTICA]
     }
     return generate_dict(dict_values, CategoryConstants.MUDANZA)
 
 
 def calc_marcha_blanca(m2: int):
-    weeks = 0
-    if m2 <= 1000:
-        weeks = 2
-    elif 1000 < m2 <= 3500:
-        weeks = 3
-    else:
-        weeks = 4
+    weeks = estimation_engine.rules.band_weeks(estimation.MARCHA_BLANCA, m2)
 
     dict_values = {
         SubCategoryConstants.MARCHA_BLANCA: weeks
@@ -503,6 +851,141 @@ def calc_marcha_blanca(m2: int):
     return generate_dict(dict_values, CategoryConstants.OCUPACION)
 
 
+ESTIMATE_PARAMS = {'adm_agility', 'client_agility', 'mun_agility', 'construction_mod',
+                   'constructions_times', 'procurement_process', 'demolitions', 'm2'}
+
+
+class InvalidLine:
+    """
+    Line of an NDJSON body that isn't valid JSON
+    """
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+def ndjson_items(lines):
+    """
+    Objects of the lines of an NDJSON body, InvalidLine for the lines that can't be parsed
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield current_app.json.loads(line)
+        except ValueError as exp:
+            yield InvalidLine(f"invalid json line {exp}")
+
+
+def estimate_params_error(params):
+    """
+    Validate the body of an estimate
+    return: error message, None if params are valid
+    """
+    if isinstance(params, InvalidLine):
+        return params.error
+    if not isinstance(params, dict):
+        return "body isn't an object"
+    for param in ESTIMATE_PARAMS:
+        if param not in params:
+            return f"{param} isn't in body"
+    m2 = params['m2']
+    if isinstance(m2, bool) or not isinstance(m2, (int, float)):
+        return "m2 isn't a number"
+    return None
+
+
+token_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE, on_lookup=metrics.cache_observer('token'))
+
+
+def decode_token(token: str) -> dict:
+    """
+    Verify a token and return its claims.
+    Verified claims are cached by token hash until the token expires.
+    """
+    token_hash = hashlib.sha256(token.encode()).digest()
+    data = token_cache.get(token_hash)
+    if data is None:
+        data = jwt.decode(token, current_app.config['PUBLIC_KEY'],
+                          algorithms=['RS256'], audience="1")
+        expires_at = data['exp'] if 'exp' in data else time.time() + TOKEN_CACHE_TTL
+        token_cache.set(token_hash, data, expires_at=expires_at)
+    return data
+
+
+SAVE_PARAMS = ESTIMATE_PARAMS | {'project_id', 'weeks'}
+TIME_GEN_COLUMNS = ('id', 'adm_agility', 'client_agility', 'mun_agility', 'construction_mod',
+                    'constructions_times', 'procurement_process', 'demolitions', 'm2', 'weeks', 'breakdown')
+
+
+def save_params_error(params):
+    """
+    Validate the body of a save
+    return: error message, None if params are valid
+    """
+    if not isinstance(params, dict):
+        return "body isn't an object"
+    for param in SAVE_PARAMS:
+        if param not in params:
+            return f"{param} isn't in body"
+    error = estimate_params_error(params)
+    if error is not None:
+        return error
+    project_id = params['project_id']
+    if isinstance(project_id, bool) or not (isinstance(project_id, int) or
+                                            isinstance(project_id, str) and project_id.isdecimal()):
+        return "project_id isn't an integer"
+    weeks = params['weeks']
+    if weeks is not None and (isinstance(weeks, bool) or not isinstance(weeks, (int, float))):
+        return "weeks isn't a number"
+    for field, options in estimation.OPTIONS.items():
+        if params[field] not in options:
+            return f"{params[field]} isn't a valid {field}"
+    return None
+
+
+def time_gen_values(params: dict) -> dict:
+    """
+    TimeGen column values of a valid body of a save
+    """
+    values = {column: params[column] for column in TIME_GEN_COLUMNS if column not in ('id', 'breakdown')}
+    values['breakdown'] = estimation.category_weeks(estimation_engine.estimate(params).subcategories)
+    values['scenario_hash'] = scenario_hash(values)
+    return values
+
+
+def scenario_hash(values: dict) -> str:
+    """
+    Stable hash of the options, m2 and weeks of a saved scenario
+    """
+    normalized = [estimation.OPTIONS[field].index(values[field]) for field in estimation.FIELDS]
+    normalized += [None if values[column] is None else float(values[column]) for column in ('m2', 'weeks')]
+    return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+
+def time_gen_ids(values_list: list) -> list:
+    """
+    Id of the TimeGen of every scenario, inserting the ones that don't exist.
+    Must be the first write of the transaction, a concurrent insert of the
+    same scenario rolls the transaction back and the scenarios are looked up again.
+    """
+    hashes = [values['scenario_hash'] for values in values_list]
+    for attempt in range(3):
+        ids = dict(db.session.query(TimeGen.scenario_hash, TimeGen.id)
+                   .filter(TimeGen.scenario_hash.in_(set(hashes))))
+        inserts = list({values['scenario_hash']: values for values in values_list
+                        if values['scenario_hash'] not in ids}.values())
+        try:
+            db.session.bulk_insert_mappings(TimeGen, inserts, return_defaults=True)
+        except IntegrityError:
+            if attempt == 2:
+                raise
+            db.session.rollback()
+            continue
+        ids.update((values['scenario_hash'], values['id']) for values in inserts)
+        return [ids[scenario] for scenario in hashes]
+
+
 def token_required(f):
     @wraps(f)
     def decorator(*args, **kwargs):
@@ -511,32 +994,50 @@ def token_required(f):
         try:
             token = bearer_token.split(" ")[1]
         except Exception as ierr:
-            app.logger.error(ierr)
+            current_app.logger.error(ierr)
             return jsonify({'message': 'a valid bearer token is missing'}), 500
 
         if not token:
-            app.logger.debug("token_required")
+            current_app.logger.debug("token_required")
             return jsonify({'message': 'a valid token is missing'})
 
-        app.logger.debug("Token: " + token)
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'],
-                              algorithms=['RS256'], audience="1")
+            data = decode_token(token)
             user_id: int = data['user_id']
             request.environ['user_id'] = user_id
-        except Exception as err:
-            return jsonify({'message': 'token is invalid', 'error': err})
         except KeyError as kerr:
-            return jsonify({'message': 'Can\'t find user_id in token', 'error': kerr})
+            return jsonify({'message': 'Can\'t find user_id in token', 'error': str(kerr)}), 401
+        except Exception as err:
+            return jsonify({'message': 'token is invalid', 'error': str(err)}), 401
 
         return f(*args, **kwargs)
 
     return decorator
 
 
-@app.route("/api/times/spec", methods=['GET'])
-@token_required
-def spec():
+@bp.route("/api/times/metrics", methods=['GET'])
+def get_metrics():
+    """
+        Metrics in Prometheus text format.
+        ---
+        tags:
+        - Times
+        produces:
+        - text/plain
+        responses:
+            200:
+                description: Request latency, SQL, projects module and cache metrics.
+    """
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+def build_spec(app: Flask) -> dict:
+    """
+    Swagger spec of the app, serialized and gzipped once.
+    Built when the app is created, the docstrings don't change while it runs.
+    return: dict with the json and gzip bodies and their ETag
+    """
     swag = swagger(app)
     swag['info']['version'] = "1.0"
     swag['info']['title'] = "WYS Layout API Service"
@@ -544,10 +1045,52 @@ def spec():
         "name": "Times",
         "description": "Methods to configure layouts"
     }]
-    return jsonify(swag)
+    body = json.dumps(swag, separators=(',', ':')).encode()
+    return {
+        'json': body,
+        # mtime=0 keeps the bytes, and so the ETag, the same across workers and restarts
+        'gzip': gzip.compress(body, mtime=0),
+        'etag': hashlib.sha256(body).hexdigest()
+    }
 
 
-@app.route('/api/times', methods=['POST'])
+@bp.route("/api/times/spec", methods=['GET'])
+@token_required
+def spec():
+    """
+        Swagger spec
+        ---
+        tags:
+          - Times
+        parameters:
+          - in: header
+            name: If-None-Match
+            type: string
+            required: false
+        responses:
+            200:
+                description: Swagger spec, gzipped when accepted. Carries an ETag.
+            304:
+                description: Same spec as the ETag sent in If-None-Match.
+    """
+    swag = current_app.config['SWAGGER_SPEC']
+    encoding = request.accept_encodings.best_match(['gzip'])
+    # The gzipped bytes are a different representation, with their own ETag
+    etag = swag['etag'] if encoding is None else f"{swag['etag']}-gzip"
+    if request.if_none_match.contains(etag):
+        response = Response(status=HTTPStatus.NOT_MODIFIED)
+    else:
+        response = Response(swag['json'] if encoding is None else swag['gzip'], mimetype='application/json')
+        if encoding is not None:
+            response.content_encoding = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # Already negotiated, brotli clients that refuse gzip get the plain spec and its ETag
+    response.precompressed = True
+    return response
+
+
+@bp.route('/api/times', methods=['POST'])
 @token_required
 def get_times():
     """
@@ -597,8 +1140,9 @@ def get_times():
                 description:  Construction Mode
                 enum: [direct, bidding]
             demolitions:
-                type: boolean
+                type: string
                 description: Demolitions needed
+                enum: ["no", "yes"]
             m2:
                 type: number
                 format: float
@@ -613,92 +1157,330 @@ def get_times():
                 description: Internal server error.
     """
 
-    req_params = {'adm_agility', 'client_agility', 'mun_agility', 'construction_mod',
-                  'constructions_times', 'procurement_process', 'demolitions', 'm2'}
+    error = estimate_params_error(request.json)
+    if error is not None:
+        return error, 400
 
-    for param in req_params:
-        if param not in request.json.keys():
-            return f"{param} isn't in body", 400
+    engine = estimation_engine
+    combination, band = engine.key(request.json)
+    key = (engine, combination, band)
+    body = result_cache.get(key)
+    if body is None:
+        body = jsonify({'weeks': engine.lookup(combination, band).weeks}).get_data()
+        result_cache.set(key, body)
 
-    # Create weeks sum
-    weeks = 0
-    # Arriendo
-    for sub_cat in calc_arriendo()["subcategories"]:
-        weeks += sub_cat['weeks']
+    return Response(body, mimetype='application/json')
 
-    # Diseno
-    map_client_agility = {
-        'high': 0,
-        'normal': 1,
-        'low': 2
-    }
-    client_agility = 0
-    if request.json['client_agility'] in map_client_agility:
-        client_agility = map_client_agility[request.json['client_agility']]
+
+@bp.route('/api/times/batch', methods=['POST'])
+@token_required
+def get_times_batch():
+    """
+        Get Weeks to Move for many configurations
+        ---
+        consumes:
+        - "application/json"
+        - "application/x-ndjson"
+        tags:
+        - Times
+        produces:
+        - application/json
+        - application/x-ndjson
+        parameters:
+        - in: body
+          name: body
+          description: Array of bodies of /api/times, or one body per line with application/x-ndjson
+          schema:
+            type: array
+            items:
+              type: object
+        responses:
+            200:
+                description: Array with weeks, or error, for each body in the same order.
+                             One result per line if application/x-ndjson is accepted.
+            400:
+                description: Body isn't an array.
+            500:
+                description: Internal server error.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        items = ndjson_items(request.stream)
     else:
-        logging.warning(f'{request.json["client_agility"]} is not a valid key')
+        items = request.json
+        if not isinstance(items, list):
+            return "body isn't an array", 400
 
-    for sub_cat in calc_diseno(client_agility, request.json['m2'])['subcategories']:
-        weeks += sub_cat['weeks']
+    if request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) \
+            == 'application/x-ndjson':
+        def generate():
+            for results in estimate_batch(items):
+                yield ''.join(current_app.json.dumps(result, sort_keys=False) + '\n' for result in results)
 
-    # Permisos
-    municipality_agility_map = {
-        'low': 8,
-        'normal': 6,
-        'high': 4
-    }
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-    building_agility_map = {
-        'low': 6,
-        'normal': 4,
-        'high': 2
-    }
-    mun_agility = 0
-    if request.json['mun_agility'] in municipality_agility_map:
-        mun_agility += municipality_agility_map[request.json['mun_agility']]
-    else:
-        logging.warning(f'{request.json["mun_agility"]} is not a valid key')
+    # Streamed results report invalid lines as errors, too late for a 400
+    items = list(items)
+    invalid = next((item for item in items if isinstance(item, InvalidLine)), None)
+    if invalid is not None:
+        return f"invalid ndjson body {invalid.error}", 400
+    results = [result for chunk in estimate_batch(items) for result in chunk]
+    return jsonify(results)
 
-    building_agility = 0
-    if request.json['adm_agility'] in building_agility_map:
-        building_agility += building_agility_map[request.json['adm_agility']]
-    else:
-        logging.warning(f'{request.json["adm_agility"]} is not a valid key')
 
-    for sub_cat in calc_permisos(mun_agility, building_agility)["subcategories"]:
-        weeks += sub_cat['weeks']
+def estimate_batch(items):
+    """
+    Estimate an iterable of bodies, BATCH_CHUNK_SIZE bodies at a time
+    return: generator of lists of results, {'weeks': weeks} or {'error': message}
+    """
+    # Every chunk with the same rules, even if they're reloaded while streaming
+    engine = estimation_engine
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, BATCH_CHUNK_SIZE))
+        if not chunk:
+            return
+
+        results = []
+        valid = []
+        for params in chunk:
+            error = estimate_params_error(params)
+            if error is None:
+                valid.append(params)
+                results.append(None)
+            else:
+                results.append({'error': error})
+
+        weeks = iter(engine.estimate_many(valid).tolist())
+        yield [{'weeks': next(weeks)} if result is None else result for result in results]
 
-    # Licitacion
-    procurement_process = request.json['procurement_process']
-    is_direct = False
-    if procurement_process == "direct":
-        is_direct = True
+@bp.route('/api/times/sweep', methods=['POST'])
+@token_required
+def get_times_sweep():
+    """
+        Get Weeks to Move over a grid of configurations
+        ---
+        consumes:
+        - "application/json"
+        tags:
+        - Times
+        produces:
+        - application/json
+        required:
+            - base
+            - axes
+        parameters:
+        - in: body
+          name: body
+          properties:
+            base:
+                type: object
+                description: Body of /api/times with the fields that don't vary
+            axes:
+                type: object
+                description: Options of each field that varies, null for every option, and
+                             {start, stop, step} for m2
+        responses:
+            200:
+                description: Axes (in body order, m2 last), shape of the grid, and total and
+                             per category weeks of every point, flattened in row major order.
+            400:
+                description: Data or missing field in body, or too many points.
+            500:
+                description: Internal server error.
+    """
+    body = request.json
+    if not isinstance(body, dict) or not isinstance(body.get('base'), dict) \
+            or not isinstance(body.get('axes'), dict):
+        return "base and axes must be objects", 400
+    base = body['base']
+
+    axes = []
+    m2 = None
+    for field, options in body['axes'].items():
+        if field == 'm2':
+            m2, error = sweep_m2_values(options)
+            if error is not None:
+                return error, 400
+        elif field in estimation.OPTIONS:
+            if options is None:
+                options = list(estimation.OPTIONS[field])
+            if not isinstance(options, list) or not options \
+                    or any(option not in estimation.OPTIONS[field] for option in options):
+                return f"{field} axis must be a list of valid options", 400
+            if len(set(options)) < len(options):
+                return f"{field} axis has repeated options", 400
+            axes.append((field, options))
+        else:
+            return f"{field} can't vary", 400
+
+    varied = {field for field, _ in axes}
+    for field in estimation.FIELDS:
+        if field not in varied and field not in base:
+            return f"{field} isn't in base", 400
+    if m2 is None:
+        if isinstance(base.get('m2'), bool) or not isinstance(base.get('m2'), (int, float)):
+            return "m2 isn't a number", 400
+        m2 = np.array([base['m2']], dtype=float)
+
+    shape = [len(options) for _, options in axes] + [len(m2)]
+    # Python ints, np.prod wraps around on int64
+    if math.prod(shape) > SWEEP_MAX_POINTS:
+        return f"grid has more than {SWEEP_MAX_POINTS} points", 400
+
+    engine = estimation_engine
+    indices = engine.sweep(base, axes, m2)
+    category_totals = engine.category_totals.reshape(-1, len(estimation.CATEGORIES))
+    axes_json = [{'field': field, 'values': options} for field, options in axes]
+    axes_json.append({'field': 'm2', 'values': m2.tolist()})
+    body = ''.join([
+        '{"axes":', json.dumps(axes_json),
+        ',"shape":', json.dumps(shape),
+        ',"weeks":', json_array(engine.totals.ravel(), indices),
+        ',"categories":{',
+        ','.join(json.dumps(category) + ':' + json_array(category_totals[:, position], indices)
+                 for position, category in enumerate(estimation.CATEGORIES)),
+        '}}'])
+    return Response(body, mimetype='application/json')
+
+
+@bp.route('/api/times/fit', methods=['POST'])
+@token_required
+def get_times_fit():
+    """
+        Get the configurations that fit within a number of weeks
+        ---
+        consumes:
+        - "application/json"
+        tags:
+        - Times
+        produces:
+        - application/json
+        required:
+            - max_weeks
+        parameters:
+        - in: body
+          name: body
+          properties:
+            max_weeks:
+                type: number
+                format: float
+            fixed:
+                type: object
+                description: Options of the fields that don't vary
+            m2:
+                type: number
+                format: float
+                description: Only the configurations that fit at this m2, with their weeks
+        responses:
+            200:
+                description: Configurations that fit, with the largest m2 that fits (null if
+                             any m2 fits), or with their weeks if m2 is given.
+            400:
+                description: Data or missing field in body.
+            500:
+                description: Internal server error.
+    """
+    body = request.json
+    if not isinstance(body, dict):
+        return "body isn't an object", 400
+    max_weeks = body.get('max_weeks')
+    if isinstance(max_weeks, bool) or not isinstance(max_weeks, (int, float)):
+        return "max_weeks isn't a number", 400
+    fixed = body.get('fixed') or {}
+    if not isinstance(fixed, dict):
+        return "fixed isn't an object", 400
+    for field, option in fixed.items():
+        if field not in estimation.OPTIONS:
+            return f"{field} can't be fixed", 400
+        if option not in estimation.OPTIONS[field]:
+            return f"{option} isn't a valid {field}", 400
+    m2 = body.get('m2')
+    if m2 is not None and (isinstance(m2, bool) or not isinstance(m2, (int, float))):
+        return "m2 isn't a number", 400
+
+    engine = estimation_engine
+    axes, combinations, last_bands = engine.fit(max_weeks, fixed)
+    if m2 is None:
+        fits = last_bands >= 0
+    else:
+        band = engine.band(m2)
+        fits = last_bands >= band
+        weeks = engine.totals[combinations, band]
+
+    configurations = []
+    for point in zip(*np.nonzero(fits)):
+        configuration = {field: options[position] for (field, options), position in zip(axes, point)}
+        if m2 is None:
+            configuration['max_m2'] = engine.band_edge(int(last_bands[point]))
+        else:
+            configuration['weeks'] = float(weeks[point])
+        configurations.append(configuration)
+    return jsonify(configurations)
 
-    for sub_cat in calc_licitacion(is_direct)["subcategories"]:
-        weeks += sub_cat['weeks']
 
+def sweep_m2_values(axis):
+    """
+    m2 values of a {start, stop, step} axis, stop included
+    return: (values, None), or (None, error message)
+    """
+    if not isinstance(axis, dict) or any(isinstance(axis.get(key), bool) or
+                                         not isinstance(axis.get(key), (int, float))
+                                         for key in ('start', 'stop', 'step')):
+        return None, "m2 axis must have numeric start, stop and step"
+    if not all(np.isfinite(float(axis[key])) for key in ('start', 'stop', 'step')):
+        return None, "m2 axis start, stop and step must be finite"
+    if axis['step'] <= 0 or axis['stop'] < axis['start']:
+        return None, "m2 axis must have a positive step and stop >= start"
+    # Checked as a float first, a huge range over a tiny step doesn't fit an int
+    count = (float(axis['stop']) - float(axis['start'])) / float(axis['step']) + 1e-9
+    if not np.isfinite(count) or count + 1 > SWEEP_MAX_POINTS:
+        return None, f"grid has more than {SWEEP_MAX_POINTS} points"
+    return axis['start'] + axis['step'] * np.arange(int(count) + 1), None
+
+
+def json_array(table: np.ndarray, indices: np.ndarray) -> str:
+    """
+    JSON array of table[indices]. Grids repeat few values, so each distinct
+    value of the table is encoded once.
+    """
+    values, inverse = np.unique(table, return_inverse=True)
+    texts = np.array([json.dumps(value) for value in values.tolist()], dtype=object)[inverse]
+    return '[' + ','.join(texts[indices].tolist()) + ']'
 
-    # Construccion
-    m2: float = request.json['m2']
-    demolition_needed: bool = True if request.json['demolitions'] == 'yes' else False
-    construction_times: str = request.json['constructions_times']
-    construction_mod: str = request.json['construction_mod']
 
-    for sub_cat in calc_construccion(m2, construction_times,
-                               demolition_needed, construction_mod)['subcategories']:
-        weeks += sub_cat['weeks']
+calendar_cache = LRUCache(maxsize=CALENDAR_CACHE_SIZE, on_lookup=metrics.cache_observer('calendar'))
 
-    # mudanza
-    for sub_cat in calc_mudanza()['subcategories']:
-        weeks += sub_cat['weeks']
 
-    # post ocupacion
-    for sub_cat in calc_marcha_blanca(m2)['subcategories']:
-        weeks += sub_cat['weeks']
+def working_calendar(holidays: list) -> np.busdaycalendar:
+    """
+    Monday to Friday calendar without the holidays, compiled once per set of holidays
+    """
+    if not isinstance(holidays, list):
+        raise TypeError("holidays isn't an array")
+    key = tuple(sorted({date.fromisoformat(holiday) for holiday in holidays}))
+    calendar = calendar_cache.get(key)
+    if calendar is None:
+        calendar = np.busdaycalendar(weekmask=WORKING_WEEK, holidays=np.array(key, dtype='datetime64[D]'))
+        calendar_cache.set(key, calendar)
+    return calendar
+
+
+def working_dates(start_date: np.datetime64, calendar: np.busdaycalendar, start_weeks: np.ndarray,
+                  end_weeks: np.ndarray) -> tuple:
+    """
+    First and last working day of spans given in weeks from start_date. A week is
+    as many working days as the calendar has per week, a span of zero weeks
+    starts and ends on the same day.
+    return: (start dates, end dates) arrays
+    """
+    days_per_week = int(calendar.weekmask.sum())
+    start_days = np.rint(start_weeks * days_per_week).astype(np.int64)
+    end_days = np.maximum(np.rint(end_weeks * days_per_week).astype(np.int64) - 1, start_days)
+    return (np.busday_offset(start_date, start_days, roll='forward', busdaycal=calendar).astype(object),
+            np.busday_offset(start_date, end_days, roll='forward', busdaycal=calendar).astype(object))
 
-    return jsonify({'weeks': weeks})
 
-@app.route('/api/times/detailed', methods=['POST'])
+@bp.route('/api/times/detailed', methods=['POST'])
 @token_required
 def get_times_detailed():
     """
@@ -748,14 +1530,29 @@ def get_times_detailed():
                 description:  Construction Mode
                 enum: [direct, bidding]
             demolitions:
-                type: boolean
+                type: string
                 description: Demolitions needed
+                enum: ["no", "yes"]
             m2:
                 type: number
                 format: float
+            start_date:
+                type: string
+                format: date
+                description: Date of the first week, adds start_date and end_date
+            holidays:
+                type: array
+                items:
+                    type: string
+                    format: date
+                description: Days off besides weekends, used with start_date
         responses:
             200:
-                description: Return weeks
+                description: Categories and subcategories in Gantt order, with weeks,
+                             start_week and end_week, and start_date and end_date if
+                             start_date is given. Carries an ETag.
+            304:
+                description: Same body as the ETag sent in If-None-Match.
             400:
                 description: Data or missing field in body.
             404:
@@ -763,27 +1560,74 @@ def get_times_detailed():
             500:
                 description: Internal server error.
     """
-    req_params = {'adm_agility', 'client_agility', 'mun_agility', 'construction_mod',
-                  'constructions_times', 'procurement_process', 'demolitions', 'm2'}
-
-    for param in req_params:
-        if param not in request.json.keys():
-            return f"{param} isn't in body", 400
-
-    categories = TimeCategory.query.all()
-    categories_dict = [category.to_dict() for category in categories]
-
-    for category in categories_dict:
+    error = estimate_params_error(request.json)
+    if error is not None:
+        return error, 400
+    start_date = request.json.get('start_date')
+    if start_date is not None:
+        try:
+            start_date = np.datetime64(date.fromisoformat(start_date), 'D')
+            calendar = working_calendar(request.json.get('holidays') or [])
+        except (TypeError, ValueError) as exp:
+            return f"start_date and holidays must be ISO dates {exp}", 400
+
+    estimate = estimation_engine.estimate(request.json)
+    weeks_by_code = dict(zip(estimation.SUBCATEGORY_CODES, estimate.subcategories))
+
+    # Lay subcategories one after the other, in Gantt order
+    categories_dict = []
+    offset = 0
+    for category in catalog.categories():
+        category_dict = dict(category)
+        category_dict['start_week'] = offset
+        category_dict['subcategories'] = []
         for sub_cat in category['subcategories']:
-            if sub_cat['is_milestone']:
-                sub_cat["weeks"] = 0
-                continue
-            sub_cat["weeks"] = randrange(3, 8, 1)
-
-    return jsonify(categories_dict)
+            sub_cat_dict = dict(sub_cat)
+            if sub_cat_dict['code'] not in weeks_by_code:
+                logging.warning('%s is not a valid subcategory code', sub_cat_dict['code'])
+            sub_cat_dict['weeks'] = weeks_by_code.get(sub_cat_dict['code'], 0)
+            sub_cat_dict['start_week'] = offset
+            offset += sub_cat_dict['weeks']
+            sub_cat_dict['end_week'] = offset
+            category_dict['subcategories'].append(sub_cat_dict)
+        category_dict['weeks'] = offset - category_dict['start_week']
+        category_dict['end_week'] = offset
+        categories_dict.append(category_dict)
+
+    if start_date is not None:
+        # Every start and end at once
+        items = [item for category_dict in categories_dict for item in [category_dict] + category_dict['subcategories']]
+        start_dates, end_dates = working_dates(start_date, calendar,
+                                               np.array([item['start_week'] for item in items], dtype=float),
+                                               np.array([item['end_week'] for item in items], dtype=float))
+        for item, item_start, item_end in zip(items, start_dates.tolist(), end_dates.tolist()):
+            item['start_date'] = item_start.isoformat()
+            item['end_date'] = item_end.isoformat()
+
+    response = jsonify(categories_dict)
+    response.add_etag()
+    etag, _ = response.get_etag()
+    # Weak comparison, compressed responses carry the weak form of the ETag
+    if request.if_none_match.contains_weak(etag):
+        not_modified = Response(status=HTTPStatus.NOT_MODIFIED)
+        not_modified.set_etag(etag)
+        return not_modified
+    return response
+
+
+def pending_links(project_ids) -> dict:
+    """
+    Newest pending outbox entry of each project, the link the project will end up with
+    """
+    entries = {}
+    for entry in ProjectUpdateOutbox.query \
+            .filter(ProjectUpdateOutbox.status == outbox.PENDING, ProjectUpdateOutbox.project_id.in_(project_ids)) \
+            .order_by(ProjectUpdateOutbox.id):
+        entries[entry.project_id] = entry
+    return entries
 
 
-@app.route('/api/times/save', methods=['POST'])
+@bp.route('/api/times/save', methods=['POST'])
 def save_times():
     """
         Save times
@@ -805,6 +1649,10 @@ def save_times():
             - demolitions
             - m2
         parameters:
+        - in: query
+          name: wait
+          type: boolean
+          description: Wait for the project to be updated before answering
         - in: body
           name: body
           properties:
@@ -836,8 +1684,9 @@ def save_times():
                 description:  Construction Mode
                 enum: [direct, bidding]
             demolitions:
-                type: boolean
+                type: string
                 description: Demolitions needed
+                enum: ["no", "yes"]
             m2:
                 type: number
                 format: float
@@ -846,83 +1695,342 @@ def save_times():
                 format: float
                 description: weeks to move
         responses:
-            200:
-                description: Return weeks
+            201:
+                description: Times saved and linked to the project.
+            202:
+                description: Times saved, the project update is pending.
             400:
                 description: Data or missing field in body.
             404:
                 description: Data object not found.
             500:
                 description: Internal server error.
+            503:
+                description: Projects module unavailable.
     """
-    req_params = {'adm_agility', 'client_agility', 'mun_agility', 'construction_mod',
-                  'constructions_times', 'procurement_process', 'demolitions', 'm2', 'project_id', 'weeks'}
-
-    for param in req_params:
-        if param not in request.json.keys():
-            return f"{param} isn't in body", 400
+    error = save_params_error(request.json)
+    if error is not None:
+        return error, 400
     token = request.headers.get('Authorization', None)
 
-
+    project_id = int(request.json["project_id"])
     try:
-        token = request.headers.get('Authorization', None)
-        headers = {'Authorization': token}
-        resp = requests.get(
-            f'{PROJECTS_URL}{PROJECTS_MODULE_API}'
-            f'/{request.json["project_id"]}', headers=headers)
-        project = json.loads(resp.content.decode('utf-8'))
+        project = projects_client.get_project(project_id, token)
+    except ProjectsUnavailable as exp:
+        logging.error(f"Error getting Project {exp}")
+        return f"Error getting project {exp}", 503
     except Exception as exp:
         logging.error(f"Error getting Project {exp}")#cambiar mensaje de exp
         return f"Error getting project {exp}", 500
+    if project is None:
+        return "Project not found", 404
 
-    gen: TimeGen = TimeGen.query \
-        .filter(TimeGen.id == project["time_gen_id"]) \
-        .first()
-    
-    time_gen_id: int
-    try: 
-        if gen is None:
-            gen = TimeGen()
-        
-        gen.weeks=request.json['weeks'],
-        gen.adm_agility=request.json['adm_agility'],
-        gen.client_agility=request.json['client_agility'],
-        gen.mun_agility=request.json['mun_agility'],
-        gen.construction_mod=request.json['construction_mod'],
-        gen.constructions_times=request.json['constructions_times'],
-        gen.procurement_process=request.json['procurement_process'],
-        gen.demolitions=request.json['demolitions'],
-        gen.m2=request.json['m2']
-
-        db.session.add(gen)
+    try:
+        # Identical scenarios share one row
+        time_gen_id, = time_gen_ids([time_gen_values(request.json)])
+
+        # Link the project in the same transaction, the dispatcher delivers it.
+        # A pending update will overwrite the project's current link.
+        entry = pending_links([project_id]).get(project_id)
+        if (entry.time_gen_id if entry is not None else project.get('time_gen_id')) != time_gen_id:
+            entry = ProjectUpdateOutbox(project_id=project_id, time_gen_id=time_gen_id, token=token)
+            db.session.add(entry)
         db.session.commit()
 
-        time_gen_id = gen.id
-
     except Exception as exp:
-        logging.error(f"Error in database {exp}")
+        # The statement's parameters hold the caller's token, keep them out
+        logging.error(f"Error in database {type(exp).__name__}")
         db.session.rollback()
-        return jsonify({'message': f"Error in database {exp}"}), 500
-  
+        return jsonify({'message': "Error in database"}), 500
 
-    project = update_project_by_id(request.json["project_id"], {'time_gen_id': time_gen_id}, token)
-    if project is not None:
-        project['time_generated_data'] = gen.to_dict()
+    gen = TimeGen.query.get(time_gen_id)
+    project['time_gen_id'] = time_gen_id
+    project['time_generated_data'] = gen.to_dict()
+    if entry is None:
         return jsonify(project), 201
-    return "Cannot update the Project because doesn't exist", 404
+
+    entry_id = entry.id
+    if request.args.get('wait', '').lower() not in ('1', 'true', 'yes'):
+        outbox_dispatcher.wake()
+        return jsonify(project), 202
+
+    # Wait for delivery
+    outbox_dispatcher.dispatch(ids=[entry_id])
+    entry = ProjectUpdateOutbox.query.get(entry_id)
+    if entry.status == outbox.DELIVERED:
+        return jsonify(project), 201
+    if entry.status == outbox.FAILED:
+        return f"Cannot update the Project {entry.error}", 404
+    return jsonify(project), 202
+
+
+@bp.route('/api/times/save/batch', methods=['POST'])
+@token_required
+def save_times_batch():
+    """
+        Save times of many projects
+        ---
+        consumes:
+        - "application/json"
+        tags:
+        - Times
+        produces:
+        - application/json
+        parameters:
+        - in: body
+          name: body
+          description: Array of bodies of /api/times/save
+          schema:
+            type: array
+            items:
+              type: object
+        responses:
+            200:
+                description: Result of each body in the same order, with its status,
+                             time_gen_id and time_generated_data, or its error.
+                             Status is 202 when the project update is pending.
+            400:
+                description: Body isn't an array.
+            500:
+                description: Internal server error.
+    """
+    items = request.json
+    if not isinstance(items, list):
+        return "body isn't an array", 400
+    token = request.headers.get('Authorization', None)
+
+    results = [None] * len(items)
+    pending = {}
+    for index, item in enumerate(items):
+        error = save_params_error(item)
+        if error is None and int(item['project_id']) in pending:
+            error = "project_id is repeated in body"
+        if error is not None:
+            results[index] = {'status': 400, 'error': error}
+        else:
+            pending[int(item['project_id'])] = index
+
+    # Existing time_gen_id of every project
+    def get_project(project_id):
+        try:
+            return projects_client.get_project(project_id, token), None, None
+        except ProjectsUnavailable as exp:
+            return None, f"Error getting project {exp}", 503
+        except Exception as exp:
+            return None, f"Error getting project {exp}", 500
+
+    projects = {}
+    for project_id, (project, error, status) in zip(pending, projects_executor.map(get_project, list(pending))):
+        if error is None and project is None:
+            error, status = "Project not found", 404
+        if error is not None:
+            results[pending[project_id]] = {'project_id': project_id, 'status': status, 'error': error}
+        else:
+            projects[project_id] = project
+
+    # Insert the new scenarios and link the projects in one transaction, identical scenarios share one row
+    try:
+        project_ids = list(projects)
+        ids = time_gen_ids([time_gen_values(items[pending[project_id]]) for project_id in project_ids])
+        time_gen_id_by_project = dict(zip(project_ids, ids))
+        # A pending update will overwrite the project's current link
+        links = {project_id: entry.time_gen_id for project_id, entry in pending_links(project_ids).items()}
+        new_links = {project_id: time_gen_id for project_id, time_gen_id in time_gen_id_by_project.items()
+                     if links.get(project_id, projects[project_id].get('time_gen_id')) != time_gen_id}
+        db.session.bulk_insert_mappings(ProjectUpdateOutbox, [
+            {'project_id': project_id, 'time_gen_id': time_gen_id, 'token': token,
+             'status': outbox.PENDING, 'attempts': 0, 'next_attempt_at': datetime.utcnow()}
+            for project_id, time_gen_id in new_links.items()])
+        db.session.commit()
+        gens = {gen.id: gen.to_dict() for gen in TimeGen.query.filter(TimeGen.id.in_(set(ids)))} if ids else {}
+    except Exception as exp:
+        logging.error(f"Error in database {type(exp).__name__}")
+        db.session.rollback()
+        return jsonify({'message': "Error in database"}), 500
+    if new_links:
+        outbox_dispatcher.wake()
+
+    for project_id, time_gen_id in time_gen_id_by_project.items():
+        status = 202 if project_id in new_links or project_id in links else 201
+        results[pending[project_id]] = {'project_id': project_id, 'status': status, 'time_gen_id': time_gen_id,
+                                        'time_generated_data': gens[time_gen_id]}
+
+    return jsonify(results)
 
 
 def update_project_by_id(project_id, data, token):
-  headers = {'Authorization': token}
-  api_url = PROJECTS_URL + PROJECTS_MODULE_API + str(project_id)
-  rv = requests.put(api_url, json=data, headers=headers)
-  if rv.status_code == 200:
-    return json.loads(rv.text)
-  elif rv.status_code == 500:
-    raise Exception("Cannot connect to the projects module")
-  return None
-
-@app.route('/api/times/saved/<project_id>', methods=['GET'])
+    return projects_client.update_project(project_id, data, token)
+
+
+def deliver_project_update(project_id, time_gen_id, token):
+    # ProjectsUnavailable (connection errors, 5xx) propagates and is retried
+    project = update_project_by_id(project_id, {'time_gen_id': time_gen_id}, token)
+    if project is None:
+        raise outbox.DeliveryRejected("Cannot update the Project because doesn't exist")
+    return project
+
+
+outbox_dispatcher = outbox.OutboxDispatcher(db, ProjectUpdateOutbox, deliver_project_update, projects_executor,
+                                            interval=OUTBOX_INTERVAL,
+                                            batch_size=OUTBOX_BATCH_SIZE,
+                                            max_attempts=OUTBOX_MAX_ATTEMPTS,
+                                            backoff=OUTBOX_BACKOFF)
+
+
+@bp.route('/api/times/saved', methods=['GET'])
+@token_required
+def get_save_times_bulk():
+    """
+        Get saved time info of many projects.
+        ---
+
+          parameters:
+            - in: query
+              name: project_ids
+              type: string
+              description: Comma separated Project IDs
+          tags:
+            - Times
+          responses:
+            200:
+              description: Saved Time Object, or error, by Project ID.
+            400:
+              description: Missing or too many project_ids.
+            500:
+              description: Internal Server error or Database error
+    """
+    # 01 and 1 are the same project, anything else than digits never reaches the projects module
+    ids = list(dict.fromkeys(
+        int(project_id) if project_id.isdecimal() else project_id
+        for project_id in (project_id.strip() for project_id in request.args.get('project_ids', '').split(','))
+        if project_id))
+    if not ids:
+        return "project_ids isn't in query", 400
+    if len(ids) > SAVED_BULK_MAX:
+        return f"project_ids can't have more than {SAVED_BULK_MAX} ids", 400
+    project_ids = [project_id for project_id in ids if isinstance(project_id, int)]
+
+    token = request.headers.get('Authorization', None)
+
+    def get_project(project_id):
+        try:
+            return projects_client.get_project(project_id, token), None
+        except Exception as exp:
+            logging.error(f"Error getting Project {project_id} {exp}")
+            return None, f"Error getting project {exp}"
+
+    results = {project_id: {'error': "project_id isn't an integer"}
+               for project_id in ids if not isinstance(project_id, int)}
+    projects = {}
+    for project_id, (project, error) in zip(project_ids, projects_executor.map(get_project, project_ids)):
+        if error is not None:
+            results[project_id] = {'error': error}
+        elif project is None or project.get('time_gen_id') is None:
+            results[project_id] = {'error': "Time Generated Config Not Found"}
+        else:
+            projects[project_id] = project['time_gen_id']
+
+    try:
+        gens = TimeGen.query.filter(TimeGen.id.in_(set(projects.values()))).all() if projects else []
+    except Exception as exp:
+        logging.error(f"Database Exception: {exp}")
+        return f"Database Exception: {exp}", 500
+
+    gens_by_id = {gen.id: gen.to_dict() for gen in gens}
+    for project_id, time_gen_id in projects.items():
+        if time_gen_id in gens_by_id:
+            results[project_id] = gens_by_id[time_gen_id]
+        else:
+            results[project_id] = {'error': "Time Generated Config Not Found"}
+
+    return jsonify({str(project_id): results[project_id] for project_id in ids})
+
+
+@bp.route('/api/times/export', methods=['GET'])
+@token_required
+def export_times():
+    """
+        Export every saved time config, streamed.
+        ---
+
+          parameters:
+            - in: query
+              name: format
+              type: string
+              enum: [ndjson, csv]
+              description: ndjson by default, or csv if text/csv is accepted
+            - in: query
+              name: after
+              type: integer
+              description: Only configs with a greater id, to resume an export
+            - in: query
+              name: m2_min
+              type: number
+            - in: query
+              name: m2_max
+              type: number
+            - in: query
+              name: adm_agility
+              type: string
+              description: Comma separated options, same for every enum field
+          tags:
+            - Times
+          responses:
+            200:
+              description: One config per line (NDJSON) or row (CSV), by id.
+            400:
+              description: Invalid filter or format.
+    """
+    export_format = request.args.get('format')
+    if export_format is None:
+        export_format = 'csv' if request.accept_mimetypes.best_match(['application/x-ndjson', 'text/csv']) \
+            == 'text/csv' else 'ndjson'
+    if export_format not in ('ndjson', 'csv'):
+        return "format must be ndjson or csv", 400
+
+    # Plain rows, no ORM objects to build
+    query = db.session.query(*(getattr(TimeGen, column) for column in TIME_GEN_COLUMNS))
+    try:
+        if 'after' in request.args:
+            query = query.filter(TimeGen.id > int(request.args['after']))
+        if 'm2_min' in request.args:
+            query = query.filter(TimeGen.m2 >= float(request.args['m2_min']))
+        if 'm2_max' in request.args:
+            query = query.filter(TimeGen.m2 <= float(request.args['m2_max']))
+    except ValueError as exp:
+        return f"after, m2_min and m2_max must be numbers {exp}", 400
+    for field, options in estimation.OPTIONS.items():
+        if field in request.args:
+            selected = request.args[field].split(',')
+            if any(option not in options for option in selected):
+                return f"{request.args[field]} isn't a valid {field}", 400
+            query = query.filter(getattr(TimeGen, field).in_(selected))
+    # Server side cursor, EXPORT_CHUNK_SIZE rows in memory at a time
+    query = query.order_by(TimeGen.id).yield_per(EXPORT_CHUNK_SIZE)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(TIME_GEN_COLUMNS)
+        for count, row in enumerate(query, 1):
+            values = row._asdict()
+            if export_format == 'csv':
+                values['breakdown'] = current_app.json.dumps(values['breakdown'], ensure_ascii=False, sort_keys=False)
+                writer.writerow([values[column] for column in TIME_GEN_COLUMNS])
+            else:
+                buffer.write(current_app.json.dumps(values, ensure_ascii=False, sort_keys=False) + '\n')
+            if count % EXPORT_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+@bp.route('/api/times/saved/<project_id>', methods=['GET'])
 @token_required
 def get_save_times(project_id):
     """
@@ -943,18 +2051,21 @@ def get_save_times(project_id):
               description: Not Found.
             500:
               description: Internal Server error or Database error
+            503:
+              description: Projects module unavailable.
     """
  
     try:
         token = request.headers.get('Authorization', None)
-        headers = {'Authorization': token}
-        resp = requests.get(
-            f'{PROJECTS_URL}{PROJECTS_MODULE_API}'
-            f'{project_id}', headers=headers)
-        project = json.loads(resp.content.decode('utf-8'))
+        project = projects_client.get_project(project_id, token)
+    except ProjectsUnavailable as exp:
+        logging.error(f"Error getting Project {exp}")
+        return f"Error getting project {exp}", 503
     except Exception as exp:
         logging.error(f"Error getting Project {exp}")#cambiar mensaje de exp
         return f"Error getting project {exp}", 500
+    if project is None:
+        return {}, 404
 
     try:
         
@@ -968,5 +2079,234 @@ def get_save_times(project_id):
         return f"Database Exception: {exp}", 500
 
 
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """
+    Create the tables and seed the categories.
+    """
+    db.create_all()
+    db.session.commit()
+    seed()
+    seed_rules()
+    click.echo('Database initialized')
+
+
+@click.command('seed-db')
+@with_appcontext
+def seed_db_command():
+    """
+    Seed the categories and rules, if there aren't any.
+    """
+    seed()
+    seed_rules()
+    click.echo('Database seeded')
+
+
+@click.command('export-rules')
+@with_appcontext
+def export_rules_command():
+    """
+    Print the latest rules as JSON.
+    """
+    version = latest_rules_version()
+    if version is None:
+        rules = estimation.DEFAULT_RULES
+    else:
+        rules = rules_from_rule_set(TimeRuleSet.query.filter(TimeRuleSet.version == version).one())
+    click.echo(json.dumps(dict(rules.to_dict(), version=version), indent=2, ensure_ascii=False))
+
+
+@click.command('publish-rules')
+@click.argument('file', type=click.File('r'))
+@with_appcontext
+def publish_rules_command(file):
+    """
+    Store the rules of a JSON file, as printed by export-rules, as a new version.
+    """
+    try:
+        rules = estimation.Rules.from_dict(json.load(file))
+    except ValueError as exp:
+        raise click.ClickException(f'Invalid rules: {exp}')
+    click.echo(f'Published rules version {publish_rules(rules)}')
+
+
+# Spellings of options saved before options were validated, compared lower-cased
+# and trimmed. Clients following the old spec sent demolitions as a boolean.
+LEGACY_OPTIONS = {
+    'demolitions': {'true': 'yes', '1': 'yes', 'y': 'yes', 'false': 'no', '0': 'no', 'n': 'no'},
+}
+
+
+def migrate_time_gen(chunk_size: int = 1000) -> tuple:
+    """
+    Move time_gen from string options to option codes: add the *_code,
+    breakdown and scenario_hash columns, backfill them, drop the string
+    columns and create the indexes. Does nothing on an already migrated table.
+
+    A string column is kept while some of its values map to no option, they
+    can be fixed by hand and the migration run again. ALTER TABLE commits on
+    its own in MySQL, so every step can be re-run: a failed migration is
+    resumed by running it again.
+    return: (number of backfilled values, {field: rows with unknown options})
+    """
+    engine = db.engine
+    table = TimeGen.__table__
+    existing = {column['name'] for column in sqlalchemy.inspect(engine).get_columns(table.name)}
+    legacy = [field for field in estimation.FIELDS if field in existing]
+
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(sqlalchemy.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+    # Options, and their legacy spellings, to codes. Unknown options stay NULL.
+    legacy_table = sqlalchemy.table(table.name, *(sqlalchemy.column(name) for field in legacy
+                                                  for name in (field, f'{field}_code')))
+    unmapped = {}
+    for field in legacy:
+        codes = {option: code for code, option in enumerate(estimation.OPTIONS[field])}
+        codes.update({spelling: codes[option] for spelling, option in LEGACY_OPTIONS.get(field, {}).items()})
+        column = legacy_table.c[field]
+        code_column = legacy_table.c[f'{field}_code']
+        with engine.begin() as conn:
+            conn.execute(legacy_table.update()
+                         .where(code_column.is_(None), column.isnot(None))
+                         .values({code_column: sqlalchemy.case(codes, value=sqlalchemy.func.lower(
+                             sqlalchemy.func.trim(column)))}))
+            unmapped[field] = conn.execute(sqlalchemy.select(sqlalchemy.func.count())
+                                           .select_from(legacy_table)
+                                           .where(code_column.is_(None), column.isnot(None))).scalar()
+        if unmapped[field]:
+            logging.warning(f'{unmapped[field]} rows of time_gen have unknown {field} options, '
+                            f'keeping the {field} column')
+        else:
+            del unmapped[field]
+            with engine.begin() as conn:
+                conn.execute(sqlalchemy.text(f'ALTER TABLE {table.name} DROP COLUMN {field}'))
+
+    # Breakdown and scenario hash of the rows that miss them. Rows that repeat
+    # a scenario keep no hash, new saves reuse the first one.
+    migrated = 0
+    last_id = 0
+    while True:
+        gens = TimeGen.query \
+            .filter(TimeGen.id > last_id, or_(TimeGen.breakdown.is_(None), TimeGen.scenario_hash.is_(None))) \
+            .order_by(TimeGen.id) \
+            .limit(chunk_size) \
+            .all()
+        if not gens:
+            break
+        hashes = {}
+        for gen in gens:
+            params = gen.to_dict()
+            if params['m2'] is None or any(params[field] is None for field in estimation.FIELDS):
+                continue
+            if gen.breakdown is None:
+                gen.breakdown = estimation.category_weeks(estimation_engine.estimate(params).subcategories)
+                migrated += 1
+            if gen.scenario_hash is None:
+                hashes.setdefault(scenario_hash(params), gen)
+        taken = {scenario for scenario, in db.session.query(TimeGen.scenario_hash)
+                 .filter(TimeGen.scenario_hash.in_(set(hashes)))} if hashes else set()
+        for scenario, gen in hashes.items():
+            if scenario not in taken:
+                gen.scenario_hash = scenario
+                migrated += 1
+        last_id = gens[-1].id
+        db.session.commit()
+
+    # Indexes last, the unique one needs the hashes
+    with engine.begin() as conn:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+    return migrated, unmapped
+
+
+@click.command('migrate-time-gen')
+@with_appcontext
+def migrate_time_gen_command():
+    """
+    Migrate time_gen to option codes, with the category breakdown and indexes.
+    """
+    migrated, unmapped = migrate_time_gen()
+    click.echo(f'{migrated} rows migrated')
+    for field, count in unmapped.items():
+        click.echo(f'{count} rows have unknown {field} options, the {field} column is kept until they are fixed')
+
+
+def create_app(config: dict = None) -> Flask:
+    """
+    Create the Times Service application.
+    Doesn't touch the database, run `flask init-db` once to create the tables.
+
+    config: overrides of the default config
+    """
+    configure_logging()
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    app.logger.removeHandler(default_handler)
+    CORS(app)
+    app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['PUBLIC_KEY_FILE'] = PUBLIC_KEY_FILE
+    if config is not None:
+        app.config.update(config)
+    # Statement errors would otherwise quote the outbox rows' bearer tokens
+    engine_options = {'hide_parameters': True}
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        # Connections per worker, gevent workers run many requests at once
+        engine_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(engine_options, **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+
+    try:
+        f = open(app.config['PUBLIC_KEY_FILE'], 'r')
+        key: str = f.read()
+        f.close()
+        app.config['SECRET_KEY'] = key
+        app.config['PUBLIC_KEY'] = load_pem_public_key(key.encode())
+    except Exception as terr:
+        app.logger.error(f'Can\'t read public key f{terr}')
+        exit(-1)
+
+    swaggerui_blueprint = get_swaggerui_blueprint(
+        SWAGGER_URL,
+        API_URL,
+        config={  # Swagger UI config overrides
+            'app_name': "WYS API - Times Service"
+        }
+    )
+    app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
+    app.register_blueprint(bp)
+    app.config['SWAGGER_SPEC'] = build_spec(app)
+
+    db.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    content_encoding.init_app(app)
+
+    app.config.setdefault('RULES_POLLING_ENABLED', RULES_POLLING_ENABLED)
+    if app.config['RULES_POLLING_ENABLED']:
+        # Loads the latest rules on the first request and polls for new versions
+        @app.before_request
+        def start_rules_poller():
+            rules_poller.start(app)
+
+    app.config.setdefault('OUTBOX_DISPATCHER_ENABLED', OUTBOX_DISPATCHER_ENABLED)
+    if app.config['OUTBOX_DISPATCHER_ENABLED']:
+        # Started on the first request, so every forked worker runs its own
+        @app.before_request
+        def start_outbox_dispatcher():
+            outbox_dispatcher.start(app)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_db_command)
+    app.cli.add_command(migrate_time_gen_command)
+    app.cli.add_command(export_rules_command)
+    app.cli.add_command(publish_rules_command)
+
+    return app
+
+
 if __name__ == '__main__':
-    app.run(host=APP_HOST, port=APP_PORT, debug=True)
+    create_app().run(host=APP_HOST, port=APP_PORT, debug=True)
@@ -1,21 +1,52 @@
 import unittest
+import gzip
+import importlib.util
+import time
+import json
+import estimation
+import main
 import os
+import jwt
+import tempfile
+import outbox
+import profiling
+from unittest import mock
+from sqlalchemy import inspect, text
 from main import TimeCategory, TimeSubcategory, seed,\
-    db, app, calc_arriendo, calc_diseno, calc_licitacion,\
-    SubCategoryConstants, calc_construccion, calc_mudanza, calc_marcha_blanca, TimeGen
+    db, create_app, calc_arriendo, calc_diseno, calc_licitacion,\
+    SubCategoryConstants, calc_construccion, calc_mudanza, calc_marcha_blanca, TimeGen,\
+    catalog, CategoryConstants, token_cache, projects_client, result_cache, outbox_dispatcher, ProjectUpdateOutbox,\
+    ProjectsUnavailable, migrate_time_gen, time_gen_values, seed_rules, rules_poller, set_estimation_rules, publish_rules
 
 
 class MyTestCase(unittest.TestCase):
     def setUp(self):
-        db.session.remove()
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
-                                                os.path.join('.', 'test.db')
+        app = create_app({
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(os.path.abspath('.'), 'test.db'),
+            'OUTBOX_DISPATCHER_ENABLED': False,
+            'RULES_POLLING_ENABLED': False
+        })
+        self.flask_app = app
+        self.context = app.app_context()
+        self.context.push()
         self.app = app.test_client()
         f = open('oauth-private.key', 'r')
         self.key = f.read()
         f.close()
+        token = jwt.encode({'user_id': 1, 'aud': '1'}, self.key, algorithm='RS256')
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.body = {
+            'adm_agility': 'low',
+            'client_agility': 'normal',
+            'mun_agility': 'high',
+            'construction_mod': 'turnkey',
+            'constructions_times': 'daytime',
+            'procurement_process': 'direct',
+            'demolitions': 'no',
+            'm2': 569.0
+        }
 
         db.create_all()
         db.session.commit()
@@ -28,6 +59,7 @@ class MyTestCase(unittest.TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        self.context.pop()
 
     def test_arriendo(self):
         seed()
@@ -74,16 +106,539 @@ class MyTestCase(unittest.TestCase):
         result = calc_marcha_blanca(5000)
         self.assertEqual(result is not {}, True)
 
+    def test_catalog(self):
+        seed()
+        category = catalog.category(CategoryConstants.ARRIENDO)
+        self.assertEqual(3, len(category['subcategories']))
+        self.assertEqual([1, 2, 3], [sub_cat['position'] for sub_cat in category['subcategories']])
+
+        sub_cat = TimeSubcategory.query \
+            .filter(TimeSubcategory.code == SubCategoryConstants.BUSQUEDA) \
+            .first()
+        sub_cat.name = "Búsqueda"
+        db.session.commit()
+        self.assertEqual("Búsqueda", catalog.subcategory(SubCategoryConstants.BUSQUEDA)['name'])
+
+    def test_get_times(self):
+        rv = self.app.post('/api/times', json=self.body, headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual(41, rv.json['weeks'])
+
+    def test_result_cache(self):
+        result_cache.clear()
+        hits = result_cache.hits
+        self.app.post('/api/times', json=self.body, headers=self.headers)
+        rv = self.app.post('/api/times', json=dict(self.body, m2=570), headers=self.headers)
+        self.assertEqual(41, rv.json['weeks'])
+        self.assertEqual(hits + 1, result_cache.hits)
+        self.assertEqual(1, len(result_cache))
+
+    def test_metrics(self):
+        self.app.post('/api/times', json=dict(self.body, mun_agility='invalid'), headers=self.headers)
+        rv = self.app.get('/api/times/metrics')
+        self.assertEqual(200, rv.status_code)
+        body = rv.data.decode()
+        self.assertIn('times_request_duration_seconds_count{method="POST",route="/api/times",status="200"}', body)
+        self.assertIn('times_enum_fallbacks_total{field="mun_agility"}', body)
+        self.assertIn('times_cache_lookups_total{cache="token",result="miss"}', body)
+
+    def test_profiling(self):
+        seed()
+        config = self.app.application.config
+        config.update(PROFILING_ENABLED=True, PROFILING_TOKEN='secret', PROFILE_DIR=tempfile.mkdtemp())
+        catalog.invalidate()
+
+        rv = self.app.post('/api/times/detailed', json=self.body, headers=self.headers)
+        self.assertNotIn('X-Profile-File', rv.headers)
+
+        catalog.invalidate()
+        rv = self.app.post('/api/times/detailed?profile=secret', json=self.body, headers=self.headers)
+        self.assertIn('sql_statements=1;', rv.headers['X-Profile-Summary'])
+        self.assertTrue(os.path.exists(rv.headers['X-Profile-File']))
+
+        profile = profiling.Profile(interval=0.001)
+        for category_id in range(3):
+            profile.record_statement('SELECT * FROM time_subcategory WHERE category_id = ?', (category_id,), 0.001)
+        profile.stop()
+        repeated = profile.repeated_statements(threshold=3)
+        self.assertEqual(1, len(repeated))
+        self.assertEqual(3, repeated[0]['distinct_parameters'])
+
+    @unittest.skipIf(importlib.util.find_spec('greenlet') is None, 'greenlet is required')
+    def test_profiling_greenlet(self):
+        # Under gevent the request greenlet is sampled where it waits while it's switched out
+        from greenlet import greenlet, getcurrent
+        main_greenlet = getcurrent()
+
+        def wait_on_projects_module():
+            main_greenlet.switch()
+
+        request_greenlet = greenlet(wait_on_projects_module)
+        request_greenlet.switch()
+        with mock.patch('profiling.current_greenlet', return_value=request_greenlet):
+            sampler = profiling.Sampler(0.001)
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+        request_greenlet.switch()
+
+        self.assertGreater(sampler.samples, 0)
+        self.assertTrue(any(function.startswith('wait_on_projects_module')
+                            for function in (entry['function'] for entry in sampler.top(5))))
+
+    def test_token_cache(self):
+        token_cache.clear()
+        hits = token_cache.hits
+        self.app.post('/api/times', json=self.body, headers=self.headers)
+        self.app.post('/api/times', json=self.body, headers=self.headers)
+        self.assertEqual(hits + 1, token_cache.hits)
+
+        rv = self.app.post('/api/times', json=self.body, headers={'Authorization': 'Bearer invalid'})
+        self.assertEqual(401, rv.status_code)
+
+    def test_rules_reload(self):
+        self.addCleanup(setattr, rules_poller, 'version', None)
+        self.addCleanup(set_estimation_rules, estimation.DEFAULT_RULES)
+        seed_rules()
+        self.assertTrue(rules_poller.poll())
+        self.assertFalse(rules_poller.poll())
+        rv = self.app.post('/api/times', json=self.body, headers=self.headers)
+        self.assertEqual(41, rv.json['weeks'])
+
+        rules = estimation.Rules.from_dict(json.loads(json.dumps(estimation.DEFAULT_RULES.to_dict())))
+        rules.factors['adm_agility']['low'] = 10
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(rules.to_dict(), f)
+            f.flush()
+            result = self.flask_app.test_cli_runner().invoke(args=['publish-rules', f.name])
+        self.assertIn('version 2', result.output)
+
+        # In flight requests keep the engine they took
+        engine = main.estimation_engine
+        self.assertTrue(rules_poller.poll())
+        self.assertIsNot(engine, main.estimation_engine)
+        self.assertEqual(41, engine.estimate(self.body).weeks)
+        rv = self.app.post('/api/times', json=self.body, headers=self.headers)
+        self.assertEqual(45, rv.json['weeks'])
+
+        result = self.flask_app.test_cli_runner().invoke(args=['export-rules'])
+        self.assertEqual(10, json.loads(result.output)['factors']['adm_agility']['low'])
+
+        # A rule set whose weeks decrease with m2 isn't loaded, fit keeps working
+        weeks = list(rules.bands[estimation.PROYECTO_EJECUTIVO][1])
+        weeks[-1] = 0
+        rules.bands[estimation.PROYECTO_EJECUTIVO] = (rules.bands[estimation.PROYECTO_EJECUTIVO][0], tuple(weeks))
+        self.assertRaises(ValueError, publish_rules, rules)
+        # Stored before rule sets were checked
+        with mock.patch.object(estimation.Rules, 'validate'):
+            publish_rules(rules)
+        rules_poller.safe_poll()
+        self.assertEqual(2, rules_poller.version)
+        rv = self.app.post('/api/times/fit', json={'max_weeks': 45}, headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+
+    def test_get_times_batch(self):
+        bodies = [self.body, dict(self.body, m2=5000), {'m2': 100}]
+        rv = self.app.post('/api/times/batch', json=bodies, headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual(41, rv.json[0]['weeks'])
+        self.assertEqual(self.app.post('/api/times', json=bodies[1], headers=self.headers).json['weeks'],
+                         rv.json[1]['weeks'])
+        self.assertIn('error', rv.json[2])
+
+        headers = dict(self.headers, Accept='application/x-ndjson')
+        rv = self.app.post('/api/times/batch', json=bodies, headers=headers)
+        self.assertEqual('application/x-ndjson', rv.mimetype)
+        self.assertEqual(3, len(rv.data.decode().splitlines()))
+
+        lines = json.dumps(self.body) + '\n{"m2": \n' + json.dumps(bodies[1]) + '\n'
+        headers = dict(headers, **{'Content-Type': 'application/x-ndjson'})
+        rv = self.app.post('/api/times/batch', data=lines, headers=headers)
+        results = [json.loads(line) for line in rv.data.decode().splitlines()]
+        self.assertEqual(3, len(results))
+        self.assertEqual(41, results[0]['weeks'])
+        self.assertTrue(results[1]['error'].startswith('invalid json line'))
+        self.assertIn('weeks', results[2])
+
+        rv = self.app.post('/api/times/batch', data=lines,
+                           headers=dict(self.headers, **{'Content-Type': 'application/x-ndjson'}))
+        self.assertEqual(400, rv.status_code)
+
+    def test_spec(self):
+        with mock.patch('main.swagger', side_effect=AssertionError('spec rebuilt per request')):
+            rv = self.app.get('/api/times/spec', headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        self.assertIn('/api/times/detailed', rv.json['paths'])
+        for path in ('/api/times', '/api/times/detailed', '/api/times/save'):
+            body, = [parameter for parameter in rv.json['paths'][path]['post']['parameters']
+                     if parameter['in'] == 'body']
+            self.assertEqual({'type': 'string', 'description': 'Demolitions needed', 'enum': ['no', 'yes']},
+                             body['properties']['demolitions'])
+        etag = rv.headers['ETag']
+
+        rv = self.app.get('/api/times/spec', headers=dict(self.headers, **{'Accept-Encoding': 'gzip'}))
+        self.assertEqual('gzip', rv.headers['Content-Encoding'])
+        self.assertEqual(rv.headers['ETag'], etag[:-1] + '-gzip"')
+        self.assertEqual(self.flask_app.config['SWAGGER_SPEC']['gzip'], rv.data)
+
+        gzip_etag = rv.headers['ETag']
+
+        rv = self.app.get('/api/times/spec', headers=dict(self.headers, **{'Accept-Encoding': 'gzip;q=0'}))
+        self.assertNotIn('Content-Encoding', rv.headers)
+        self.assertEqual(etag, rv.headers['ETag'])
+
+        rv = self.app.get('/api/times/spec', headers=dict(self.headers, **{'If-None-Match': etag}))
+        self.assertEqual(304, rv.status_code)
+        self.assertEqual(b'', rv.data)
+
+        # The compression hook leaves the spec's representation alone
+        rv = self.app.get('/api/times/spec', headers=dict(self.headers, **{'Accept-Encoding': 'br'}))
+        self.assertNotIn('Content-Encoding', rv.headers)
+        self.assertEqual(etag, rv.headers['ETag'])
+        rv = self.app.get('/api/times/spec', headers=dict(self.headers, **{'Accept-Encoding': 'br',
+                                                                          'If-None-Match': etag}))
+        self.assertEqual(304, rv.status_code)
+
+        # Only the ETag of the representation sent matches
+        rv = self.app.get('/api/times/spec', headers=dict(self.headers, **{'If-None-Match': gzip_etag}))
+        self.assertEqual(200, rv.status_code)
+        rv = self.app.get('/api/times/spec', headers=dict(self.headers, **{'If-None-Match': gzip_etag,
+                                                                          'Accept-Encoding': 'gzip'}))
+        self.assertEqual(304, rv.status_code)
+
+    def test_get_times_detailed(self):
+        seed()
+        rv = self.app.post('/api/times/detailed', json=self.body, headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual(7, len(rv.json))
+        self.assertEqual(0, rv.json[0]['start_week'])
+        self.assertEqual(41, rv.json[-1]['end_week'])
+        for previous, category in zip(rv.json, rv.json[1:]):
+            self.assertEqual(previous['end_week'], category['start_week'])
+
+        headers = dict(self.headers, **{'If-None-Match': rv.headers['ETag']})
+        rv = self.app.post('/api/times/detailed', json=self.body, headers=headers)
+        self.assertEqual(304, rv.status_code)
+
+        detailed = self.app.post('/api/times/detailed', json=self.body, headers=self.headers).json
+        rv = self.app.post('/api/times/detailed', json=self.body,
+                           headers=dict(self.headers, **{'Accept-Encoding': 'gzip'}))
+        self.assertEqual('gzip', rv.headers['Content-Encoding'])
+        self.assertEqual(detailed, json.loads(gzip.decompress(rv.data)))
+        headers = dict(self.headers, **{'If-None-Match': rv.headers['ETag'], 'Accept-Encoding': 'gzip'})
+        rv = self.app.post('/api/times/detailed', json=self.body, headers=headers)
+        self.assertEqual(304, rv.status_code)
+
+        body = dict(self.body, start_date='2026-12-21', holidays=['2026-12-25', '2027-01-01'])
+        rv = self.app.post('/api/times/detailed', json=body, headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        busqueda = rv.json[0]['subcategories'][0]
+        # 2 weeks are 10 working days, without the weekends and holidays
+        self.assertEqual(('2026-12-21', '2027-01-05'), (busqueda['start_date'], busqueda['end_date']))
+        self.assertEqual('2027-01-06', rv.json[0]['subcategories'][1]['start_date'])
+        rv = self.app.post('/api/times/detailed', json=dict(body, holidays=['25/12/2026']), headers=self.headers)
+        self.assertEqual(400, rv.status_code)
+
+    def test_get_times_sweep(self):
+        body = {'base': self.body, 'axes': {'construction_mod': ['const_adm', 'turnkey'], 'demolitions': None,
+                                            'm2': {'start': 100, 'stop': 1000, 'step': 100}}}
+        rv = self.app.post('/api/times/sweep', json=body, headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual([2, 2, 10], rv.json['shape'])
+        self.assertEqual(['construction_mod', 'demolitions', 'm2'], [axis['field'] for axis in rv.json['axes']])
+        self.assertEqual(40, len(rv.json['weeks']))
+        # turnkey, no demolitions, m2 500
+        point = (1 * 2 + 0) * 10 + 4
+        self.assertEqual(41, rv.json['weeks'][point])
+        self.assertEqual(41, sum(weeks[point] for weeks in rv.json['categories'].values()))
+
+        body['axes']['m2']['step'] = 0
+        rv = self.app.post('/api/times/sweep', json=body, headers=self.headers)
+        self.assertEqual(400, rv.status_code)
+        rv = self.app.post('/api/times/sweep', json={'base': {}, 'axes': {'m2': None}}, headers=self.headers)
+        self.assertEqual(400, rv.status_code)
+        body['axes']['m2'] = {'start': 0, 'stop': 1e308, 'step': 1e-300}
+        rv = self.app.post('/api/times/sweep', json=body, headers=self.headers)
+        self.assertEqual(400, rv.status_code)
+        self.assertIsNone(main.sweep_m2_values({'start': -1e308, 'stop': 1e308, 'step': 1})[0])
+        for value in (float('nan'), float('inf')):
+            self.assertIsNone(main.sweep_m2_values({'start': 0, 'stop': 100, 'step': value})[0])
+
+        # 512 ** 7 points wrap around to a negative count in int64
+        axes = {field: [options[0]] * 512 for field, options in estimation.OPTIONS.items()}
+        rv = self.app.post('/api/times/sweep', json={'base': {'m2': 100}, 'axes': axes}, headers=self.headers)
+        self.assertEqual(400, rv.status_code)
+        body['axes'] = {'demolitions': ['no', 'no']}
+        rv = self.app.post('/api/times/sweep', json=body, headers=self.headers)
+        self.assertEqual(400, rv.status_code)
+
+    def test_get_times_fit(self):
+        fixed = {field: self.body[field] for field in ('adm_agility', 'client_agility', 'mun_agility',
+                                                        'construction_mod', 'procurement_process')}
+        rv = self.app.post('/api/times/fit', json={'max_weeks': 41, 'fixed': fixed}, headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        configurations = {(configuration['constructions_times'], configuration['demolitions']):
+                          configuration['max_m2'] for configuration in rv.json}
+        # 569 m2 takes 41 weeks in the 300-600 band
+        self.assertEqual(600, configurations[('daytime', 'no')])
+        self.assertNotIn(('nightime', 'yes'), configurations)
+
+        rv = self.app.post('/api/times/fit', json={'max_weeks': 41, 'fixed': fixed, 'm2': 569.0},
+                           headers=self.headers)
+        self.assertIn(dict(fixed, constructions_times='daytime', demolitions='no', weeks=41), rv.json)
+        self.assertTrue(all(configuration['weeks'] <= 41 for configuration in rv.json))
+
+        rv = self.app.post('/api/times/fit', json={'max_weeks': 41, 'fixed': {'m2': 1}}, headers=self.headers)
+        self.assertEqual(400, rv.status_code)
+
+    def test_get_save_times_bulk(self):
+        gen = TimeGen(m2=569.0, weeks=41)
+        db.session.add(gen)
+        db.session.commit()
+        projects = {1: {'id': 1, 'time_gen_id': gen.id}, 2: {'id': 2, 'time_gen_id': None}}
+
+        with mock.patch.object(projects_client, 'get_project',
+                               side_effect=lambda project_id, token: projects.get(project_id)) as get_project:
+            rv = self.app.get('/api/times/saved?project_ids=1,2,3,01,1/../../users/7', headers=self.headers)
+
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual({'1', '2', '3', '1/../../users/7'}, set(rv.json))
+        self.assertEqual(gen.id, rv.json['1']['id'])
+        self.assertIn('error', rv.json['2'])
+        self.assertIn('error', rv.json['3'])
+        self.assertEqual("project_id isn't an integer", rv.json['1/../../users/7']['error'])
+        self.assertEqual([1, 2, 3], sorted(call.args[0] for call in get_project.call_args_list))
+
+    def test_export_times(self):
+        for m2, demolitions in ((100.0, 'no'), (569.0, 'yes'), (569.0, 'no'), (2000.0, 'no')):
+            db.session.add(TimeGen(**time_gen_values(dict(self.body, m2=m2, demolitions=demolitions, weeks=1))))
+        db.session.commit()
+
+        rv = self.app.get('/api/times/export?demolitions=no&m2_min=500', headers=self.headers)
+        self.assertEqual(200, rv.status_code)
+        rows = [json.loads(line) for line in rv.data.decode().splitlines()]
+        self.assertEqual([(569.0, 'no'), (2000.0, 'no')], [(row['m2'], row['demolitions']) for row in rows])
+
+        rv = self.app.get(f"/api/times/export?after={rows[0]['id']}", headers=dict(self.headers, Accept='text/csv'))
+        self.assertEqual('text/csv', rv.mimetype)
+        lines = rv.data.decode().splitlines()
+        self.assertTrue(lines[0].startswith('id,adm_agility,'))
+        self.assertEqual(2, len(lines))
+
+        rv = self.app.get('/api/times/export?demolitions=maybe', headers=self.headers)
+        self.assertEqual(400, rv.status_code)
+
+    def test_save_times(self):
+        with mock.patch.object(projects_client, 'get_project',
+                               side_effect=lambda project_id, token: {'id': project_id, 'time_gen_id': None}), \
+                mock.patch.object(projects_client, 'update_project',
+                                  side_effect=lambda project_id, data, token: dict(data, id=project_id)) \
+                as update_project:
+            rv = self.app.post('/api/times/save', json=dict(self.body, project_id=1, weeks=41),
+                               headers=self.headers)
+            self.assertEqual(202, rv.status_code)
+            update_project.assert_not_called()
+
+            rv = self.app.post('/api/times/save', json=dict(self.body, project_id=1, weeks=41, demolitions='maybe'),
+                               headers=self.headers)
+            self.assertEqual(400, rv.status_code)
+
+            rv = self.app.post('/api/times/save?wait=true', json=dict(self.body, project_id=1, weeks=41),
+                               headers=self.headers)
+
+        self.assertEqual(201, rv.status_code)
+        self.assertEqual('low', rv.json['time_generated_data']['adm_agility'])
+        self.assertEqual(41, TimeGen.query.get(rv.json['time_gen_id']).weeks)
+        self.assertEqual(1, TimeGen.query.count())
+        self.assertEqual(41, sum(rv.json['time_generated_data']['breakdown'].values()))
+        # The second save waited on the update still pending from the first one
+        update_project.assert_called_once_with(1, {'time_gen_id': rv.json['time_gen_id']}, mock.ANY)
+        self.assertEqual([outbox.DELIVERED],
+                         [entry.status for entry in ProjectUpdateOutbox.query.order_by(ProjectUpdateOutbox.id)])
+        self.assertIsNone(ProjectUpdateOutbox.query.filter_by(status=outbox.DELIVERED).one().token)
+
+    def test_save_times_database_error(self):
+        # The insert fails with the token among its parameters
+        db.session.execute(text("CREATE TRIGGER outbox_full BEFORE INSERT ON project_update_outbox "
+                                "BEGIN SELECT RAISE(ABORT, 'outbox is full'); END"))
+        db.session.commit()
+
+        with mock.patch.object(projects_client, 'get_project',
+                               side_effect=lambda project_id, token: {'id': project_id, 'time_gen_id': None}), \
+                self.assertLogs(level='ERROR') as logs:
+            rv = self.app.post('/api/times/save', json=dict(self.body, project_id=1, weeks=41),
+                               headers=self.headers)
+
+        self.assertEqual(500, rv.status_code)
+        # Long parameters are truncated, the start of the token is enough to leak it
+        token = self.headers['Authorization'][:40]
+        self.assertNotIn(token, rv.data.decode())
+        self.assertNotIn(token, '\n'.join(logs.output))
+        self.assertTrue(db.engine.hide_parameters)
+
+    def test_save_times_pending_link(self):
+        linked = TimeGen(**time_gen_values(dict(self.body, weeks=41)))
+        db.session.add(linked)
+        db.session.commit()
+        body_a = dict(self.body, project_id=1, weeks=41)
+        body_b = dict(body_a, m2=1000.0, weeks=50)
+
+        with mock.patch.object(projects_client, 'get_project',
+                               side_effect=lambda project_id, token: {'id': project_id, 'time_gen_id': linked.id}), \
+                mock.patch.object(projects_client, 'update_project',
+                                  side_effect=lambda project_id, data, token: dict(data, id=project_id)) \
+                as update_project:
+            self.assertEqual(202, self.app.post('/api/times/save', json=body_b, headers=self.headers).status_code)
+            # The project still reports A, but the pending update would link it to B
+            rv = self.app.post('/api/times/save', json=body_a, headers=self.headers)
+            self.assertEqual(202, rv.status_code)
+            # Already pending, not enqueued again
+            rv = self.app.post('/api/times/save/batch', json=[body_a], headers=self.headers)
+            self.assertEqual(202, rv.json[0]['status'])
+            self.assertEqual(2, ProjectUpdateOutbox.query.count())
+            outbox_dispatcher.dispatch()
+
+        update_project.assert_called_once_with(1, {'time_gen_id': linked.id}, mock.ANY)
+
+    def test_save_times_batch(self):
+        gen = TimeGen(**time_gen_values(dict(self.body, weeks=41)))
+        db.session.add(gen)
+        db.session.commit()
+        projects = {1: {'id': 1, 'time_gen_id': gen.id}, 2: {'id': 2, 'time_gen_id': None}}
+        items = [dict(self.body, project_id=project_id, weeks=41) for project_id in (1, '2', 3)]
+        items.append({'project_id': 4})
+        items += [dict(self.body, project_id=project_id, weeks=41) for project_id in ([5], {'id': 6}, True, '2')]
+
+        with mock.patch.object(projects_client, 'get_project',
+                               side_effect=lambda project_id, token: projects.get(project_id)), \
+                mock.patch.object(projects_client, 'update_project',
+                                  side_effect=lambda project_id, data, token: dict(projects[project_id], **data)) \
+                as update_project:
+            rv = self.app.post('/api/times/save/batch', json=items, headers=self.headers)
+            update_project.assert_not_called()
+            self.assertEqual(1, outbox_dispatcher.dispatch())
+
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual([201, 202, 404, 400, 400, 400, 400, 400], [result['status'] for result in rv.json])
+        self.assertEqual("project_id isn't an integer", rv.json[4]['error'])
+        self.assertEqual("project_id is repeated in body", rv.json[7]['error'])
+        # Both projects share the row of the scenario
+        self.assertEqual([gen.id, gen.id], [result['time_gen_id'] for result in rv.json[:2]])
+        self.assertEqual(569.0, rv.json[0]['time_generated_data']['m2'])
+        self.assertEqual(1, TimeGen.query.count())
+        update_project.assert_called_once_with(2, {'time_gen_id': rv.json[1]['time_gen_id']}, mock.ANY)
+
+    def test_outbox_retry(self):
+        gen = TimeGen(m2=100.0, weeks=1)
+        db.session.add(gen)
+        db.session.commit()
+        db.session.add(ProjectUpdateOutbox(project_id=1, time_gen_id=gen.id, token='token'))
+        db.session.add(ProjectUpdateOutbox(project_id=2, time_gen_id=gen.id, token='token'))
+        db.session.commit()
+
+        def update_project(project_id, data, token):
+            if project_id == 1:
+                raise ProjectsUnavailable('projects module answered 503')
+            return None
+
+        with mock.patch.object(projects_client, 'update_project', side_effect=update_project):
+            self.assertEqual(2, outbox_dispatcher.dispatch())
+            # Not due yet
+            self.assertEqual(0, outbox_dispatcher.dispatch())
+
+        retried, rejected = ProjectUpdateOutbox.query.order_by(ProjectUpdateOutbox.id).all()
+        self.assertEqual((outbox.PENDING, 1, 'token'), (retried.status, retried.attempts, retried.token))
+        self.assertGreater(retried.next_attempt_at, retried.created_at)
+        self.assertEqual((outbox.FAILED, None), (rejected.status, rejected.token))
+
+    def test_outbox_retry_status(self):
+        gen = TimeGen(m2=100.0, weeks=1)
+        db.session.add(gen)
+        db.session.commit()
+        db.session.add(ProjectUpdateOutbox(project_id=1, time_gen_id=gen.id, token='token'))
+        db.session.add(ProjectUpdateOutbox(project_id=2, time_gen_id=gen.id, token='token'))
+        db.session.commit()
+
+        # The projects module is down for project 1, project 2 doesn't exist
+        statuses = {1: 503, 2: 404}
+        with mock.patch.object(projects_client, 'request',
+                               side_effect=lambda method, project_id, token, **kwargs:
+                               mock.Mock(status_code=statuses[project_id])):
+            self.assertEqual(2, outbox_dispatcher.dispatch())
+
+        retried, rejected = ProjectUpdateOutbox.query.order_by(ProjectUpdateOutbox.id).all()
+        self.assertEqual((outbox.PENDING, 1, 'token'), (retried.status, retried.attempts, retried.token))
+        self.assertEqual(outbox.FAILED, rejected.status)
+
+    def test_outbox_supersede(self):
+        gen = TimeGen(m2=100.0, weeks=1)
+        db.session.add(gen)
+        db.session.commit()
+        for _ in range(4):
+            db.session.add(ProjectUpdateOutbox(project_id=1, time_gen_id=gen.id, token='token'))
+        db.session.commit()
+        ids = [entry.id for entry in ProjectUpdateOutbox.query.order_by(ProjectUpdateOutbox.id)]
+
+        with mock.patch.object(projects_client, 'update_project', return_value={'id': 1}):
+            # The first row is superseded outside the batch, the second one within it
+            self.assertEqual(2, outbox_dispatcher.dispatch(ids[1:3]))
+            self.assertEqual(1, outbox_dispatcher.dispatch())
+
+        db.session.expire_all()
+        entries = ProjectUpdateOutbox.query.order_by(ProjectUpdateOutbox.id).all()
+        self.assertEqual([outbox.SUPERSEDED, outbox.SUPERSEDED, outbox.DELIVERED, outbox.DELIVERED],
+                         [entry.status for entry in entries])
+        self.assertEqual([None] * 4, [entry.token for entry in entries])
+
+    def test_migrate_time_gen(self):
+        db.session.execute(text('DROP TABLE time_gen'))
+        db.session.execute(text('CREATE TABLE time_gen (id INTEGER PRIMARY KEY, adm_agility VARCHAR(45), '
+                                'client_agility VARCHAR(45), mun_agility VARCHAR(45), '
+                                'construction_mod VARCHAR(45), constructions_times VARCHAR(45), '
+                                'procurement_process VARCHAR(45), demolitions VARCHAR(45), m2 FLOAT, weeks FLOAT)'))
+        db.session.execute(text("INSERT INTO time_gen VALUES (1, 'low', 'normal', 'high', 'turnkey', 'daytime', "
+                                "'direct', 'no', 569.0, 41), (2, 'bad', 'normal', 'high', 'turnkey', 'daytime', "
+                                "'direct', 'no', 569.0, 41), (3, 'low', 'normal', 'high', 'turnkey', 'daytime', "
+                                "'direct', 'no', 569.0, 41), (4, ' Low', 'normal', 'high', 'turnkey', 'daytime', "
+                                "'direct', 'True', 569.0, 41)"))
+        db.session.commit()
+
+        # Breakdown and hash of 1 and 4, breakdown of 3, a duplicate of 1. The unknown option of 2 is kept.
+        self.assertEqual((5, {'adm_agility': 1}), migrate_time_gen())
+        columns = {column['name'] for column in inspect(db.engine).get_columns('time_gen')}
+        self.assertIn('adm_agility', columns)
+        self.assertNotIn('demolitions', columns)
+        self.assertEqual('yes', TimeGen.query.get(4).demolitions)
+        self.assertEqual('low', TimeGen.query.get(4).adm_agility)
+        self.assertIsNone(TimeGen.query.get(2).adm_agility)
+
+        # Fixed by hand
+        db.session.execute(text("UPDATE time_gen SET adm_agility = 'high' WHERE id = 2"))
+        db.session.commit()
+        self.assertEqual((2, {}), migrate_time_gen())
+        self.assertEqual((0, {}), migrate_time_gen())
+        self.assertNotIn('adm_agility', {column['name'] for column in inspect(db.engine).get_columns('time_gen')})
+
+        gen = TimeGen.query.get(1)
+        self.assertEqual(dict(self.body, id=1, weeks=41), {column: value for column, value in gen.to_dict().items()
+                                                           if column != 'breakdown'})
+        self.assertEqual(41, sum(gen.breakdown.values()))
+        self.assertEqual(time_gen_values(dict(self.body, weeks=41))['scenario_hash'], gen.scenario_hash)
+        self.assertEqual('high', TimeGen.query.get(2).adm_agility)
+        self.assertIsNone(TimeGen.query.get(3).scenario_hash)
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('time_gen')}
+        self.assertEqual({'ix_time_gen_configuration_m2', 'ix_time_gen_m2', 'ux_time_gen_scenario_hash'}, indexes)
+
     def test_gen(self):
 
         gen = TimeGen(
             adm_agility="low",
             client_agility="low",
-            mun_agility="medium",
-            construction_mod="low",
-            constructions_times="medium",
-            procurement_process="high",
-            demolitions="high",
+            mun_agility="normal",
+            construction_mod="turnkey",
+            constructions_times="daytime",
+            procurement_process="bidding",
+            demolitions="yes",
             m2=40.5
         )
 
@@ -0,0 +1,103 @@
+"""
+Prometheus metrics of the Times Service.
+
+When PROMETHEUS_MULTIPROC_DIR is set every gunicorn worker writes its samples
+to that directory and /api/times/metrics aggregates the samples of all of
+them. The directory must exist and be emptied before gunicorn starts.
+"""
+import os
+import time
+from flask import Flask, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_LATENCY = Histogram(
+    'times_request_duration_seconds', 'Request latency by route, method and status',
+    ['route', 'method', 'status'])
+SQL_STATEMENTS = Counter(
+    'times_sql_statements_total', 'SQL statements run')
+SQL_DURATION = Histogram(
+    'times_sql_duration_seconds', 'SQL statement duration',
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, float('inf')))
+PROJECTS_LATENCY = Histogram(
+    'times_projects_request_duration_seconds', 'Projects module calls latency by method and outcome',
+    ['method', 'outcome'])
+ENUM_FALLBACKS = Counter(
+    'times_enum_fallbacks_total', 'Invalid options replaced by the field fallback',
+    ['field'])
+CACHE_LOOKUPS = Counter(
+    'times_cache_lookups_total', 'Cache lookups by cache and result (hit, miss)',
+    ['cache', 'result'])
+
+
+def observe_projects_call(method: str, outcome: str, seconds: float):
+    PROJECTS_LATENCY.labels(method, outcome).observe(seconds)
+
+
+def count_enum_fallback(field: str, option):
+    ENUM_FALLBACKS.labels(field).inc()
+
+
+def cache_observer(name: str):
+    """
+    Lookup callback for a LRUCache, counts hits and misses of the cache `name`.
+    """
+    hits = CACHE_LOOKUPS.labels(name, 'hit')
+    misses = CACHE_LOOKUPS.labels(name, 'miss')
+
+    def observe(hit: bool):
+        (hits if hit else misses).inc()
+
+    return observe
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_started'].pop()
+    SQL_STATEMENTS.inc()
+    SQL_DURATION.observe(time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+    started = context.connection.info.get('metrics_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def before_request():
+    g.metrics_started = time.perf_counter()
+
+
+def after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_LATENCY.labels(route, request.method, str(response.status_code)) \
+            .observe(time.perf_counter() - started)
+    return response
+
+
+def init_app(app: Flask):
+    app.before_request(before_request)
+    app.after_request(after_request)
+
+
+def render() -> tuple:
+    """
+    Metrics in Prometheus text format
+    return: (body, content type)
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,150 @@
+"""
+Transactional outbox for project updates.
+
+Rows are written in the same transaction as the TimeGen they link, and a
+background dispatcher delivers them to the projects module: in batches,
+deduplicated by project (only the latest pending row of a project is sent),
+retried with exponential backoff, and claimed with SKIP LOCKED so that the
+dispatchers of several workers don't deliver the same row.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DELIVERED = 'delivered'
+FAILED = 'failed'
+SUPERSEDED = 'superseded'
+
+
+class DeliveryRejected(Exception):
+    """
+    The projects module refused the update, it won't be retried.
+    """
+
+
+class OutboxDispatcher:
+    """
+    Delivers pending outbox rows.
+
+    db: Flask-SQLAlchemy instance
+    model: outbox model, with project_id, time_gen_id, token, status,
+           attempts, next_attempt_at, delivered_at and error columns
+    deliver: callable (project_id, time_gen_id, token) -> project dict,
+             raises DeliveryRejected on permanent failures and any other
+             exception on failures worth retrying
+    executor: executor used to deliver the rows of a batch concurrently
+    """
+
+    def __init__(self, db, model, deliver, executor, interval: float = 1, batch_size: int = 50,
+                 max_attempts: int = 8, backoff: float = 2):
+        self.db = db
+        self.model = model
+        self.deliver = deliver
+        self.executor = executor
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._app = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        """
+        Start the dispatcher thread of this process, if it isn't running.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self.run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with self._app.app_context():
+                    while self.dispatch() == self.batch_size:
+                        pass
+            except Exception:
+                logger.exception('outbox dispatch failed')
+
+    def dispatch(self, ids: list = None) -> int:
+        """
+        Deliver one batch of due rows, or the given rows
+        return: number of rows claimed
+        """
+        session = self.db.session
+        model = self.model
+        now = datetime.utcnow()
+        try:
+            query = session.query(model).filter(model.status == PENDING)
+            if ids is not None:
+                query = query.filter(model.id.in_(ids))
+            else:
+                query = query.filter(model.next_attempt_at <= now)
+            entries = query.order_by(model.id) \
+                .limit(self.batch_size) \
+                .with_for_update(skip_locked=True) \
+                .all()
+            if not entries:
+                session.commit()
+                return 0
+
+            # Only the latest update of each project is delivered
+            latest = {}
+            for entry in entries:
+                previous = latest.get(entry.project_id)
+                if previous is not None:
+                    previous.status = SUPERSEDED
+                    previous.token = None
+                latest[entry.project_id] = entry
+            session.query(model) \
+                .filter(model.status == PENDING,
+                        or_(*(and_(model.project_id == entry.project_id, model.id < entry.id)
+                              for entry in latest.values()))) \
+                .update({model.status: SUPERSEDED, model.token: None}, synchronize_session=False)
+
+            deliveries = [(entry.project_id, entry.time_gen_id, entry.token) for entry in latest.values()]
+            outcomes = self.executor.map(lambda delivery: self.try_deliver(*delivery), deliveries)
+            for entry, error in zip(latest.values(), outcomes):
+                entry.attempts += 1
+                if error is None:
+                    entry.status = DELIVERED
+                    entry.delivered_at = now
+                    entry.token = None
+                elif isinstance(error, DeliveryRejected) or entry.attempts >= self.max_attempts:
+                    entry.status = FAILED
+                    entry.token = None
+                else:
+                    entry.next_attempt_at = now + timedelta(seconds=self.backoff ** entry.attempts)
+                if error is not None:
+                    entry.error = str(error)
+                    logger.warning('project %s update failed: %s', entry.project_id, error)
+            session.commit()
+            return len(entries)
+        except Exception:
+            session.rollback()
+            raise
+
+    def try_deliver(self, project_id, time_gen_id, token):
+        """
+        return: None if delivered, the exception otherwise
+        """
+        try:
+            self.deliver(project_id, time_gen_id, token)
+            return None
+        except Exception as exp:
+            return exp
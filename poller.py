@@ -0,0 +1,70 @@
+"""
+Version polling.
+
+A background thread per worker reads a version number every few seconds and
+reloads whatever it versions when the number changes. Reloads build the new
+state aside and swap it in, requests in flight keep the state they started with.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class VersionPoller:
+    """
+    Calls `reload(version)` when `latest()` returns a new version.
+
+    latest: callable -> latest version, None if there isn't any
+    reload: callable (version), loads and swaps in that version
+    interval: seconds between polls
+    """
+
+    def __init__(self, latest, reload, interval: float = 5):
+        self.latest = latest
+        self.reload = reload
+        self.interval = interval
+        self.version = None
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        """
+        Load the latest version and start the polling thread of this process,
+        if it isn't running. Called from an app context.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self.safe_poll()
+            self._thread = threading.Thread(target=self.run, name='version-poller', daemon=True)
+            self._thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._app.app_context():
+                self.safe_poll()
+
+    def safe_poll(self):
+        try:
+            self.poll()
+        except Exception:
+            logger.exception('version poll failed, keeping version %s', self.version)
+
+    def poll(self) -> bool:
+        """
+        return: True if a new version was loaded
+        """
+        version = self.latest()
+        if version is None or version == self.version:
+            return False
+        self.reload(version)
+        logger.info('loaded version %s', version)
+        self.version = version
+        return True
@@ -0,0 +1,227 @@
+"""
+On-demand request profiling.
+
+Disabled unless PROFILING_ENABLED is set in the app config. A request is
+profiled when it also carries the PROFILING_TOKEN in the X-Profile header or
+in the `profile` query parameter. A profiled request runs under a sampling
+profiler, records every SQL statement it issues and flags statements that
+are repeated with only their parameters changing (suspected N+1 queries).
+The report is written as JSON to PROFILE_DIR, and a summary is added to the
+response headers.
+
+Under gevent workers a request runs in a greenlet: the sampler runs in a
+real thread and samples that greenlet, its running frames or, while it's
+switched out (waiting on the network or the database), where it waits.
+"""
+import hmac
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from flask import Flask, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    from gevent import monkey
+except ImportError:  # pragma: no cover
+    monkey = None
+
+# Profile of the request running in the current thread, or greenlet under gevent
+_local = threading.local()
+
+
+def original(module: str, name: str):
+    """
+    Function of a standard module as it was before gevent patched it.
+    """
+    if monkey is not None:
+        return monkey.get_original(module, name)
+    return getattr(importlib.import_module(module), name)
+
+
+def current_greenlet():
+    """
+    Greenlet running the request, None unless gevent patched threading.
+    """
+    if monkey is None or not monkey.is_module_patched('threading'):
+        return None
+    from greenlet import getcurrent
+    return getcurrent()
+
+
+class Sampler:
+    """
+    Samples the stack of the calling thread, or greenlet, every `interval` seconds.
+    """
+
+    def __init__(self, interval: float):
+        self.thread_id = original('_thread', 'get_ident')()
+        self.greenlet = current_greenlet()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = False
+        self._sleep = original('time', 'sleep')
+        # A real thread, a greenlet would only sample when the request yields
+        self._done = original('_thread', 'allocate_lock')()
+        self._done.acquire()
+
+    def start(self):
+        original('_thread', 'start_new_thread')(self.run, ())
+
+    def frame(self):
+        if self.greenlet is not None and self.greenlet.gr_frame is not None:
+            # Switched out
+            return self.greenlet.gr_frame
+        return sys._current_frames().get(self.thread_id)
+
+    def run(self):
+        try:
+            while True:
+                self._sleep(self.interval)
+                if self._stopped:
+                    return
+                frame = self.frame()
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+        finally:
+            self._done.release()
+
+    def stop(self):
+        self._stopped = True
+        self._done.acquire()
+
+    def top(self, limit: int) -> list:
+        """
+        Functions with most samples, inclusive and self.
+        """
+        inclusive = Counter()
+        exclusive = Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack):
+                inclusive[function] += count
+            if stack:
+                exclusive[stack[-1]] += count
+        return [{'function': function, 'samples': count, 'self_samples': exclusive[function]}
+                for function, count in inclusive.most_common(limit)]
+
+
+class Profile:
+    """
+    Sampled stacks and SQL statements of one request.
+    """
+
+    def __init__(self, interval: float):
+        self.statements = []
+        self.started = time.perf_counter()
+        self.duration = None
+        self.sampler = Sampler(interval)
+        self.sampler.start()
+
+    def record_statement(self, statement: str, parameters, seconds: float):
+        self.statements.append((statement, repr(parameters), seconds))
+
+    def stop(self):
+        self.sampler.stop()
+        self.duration = time.perf_counter() - self.started
+
+    def repeated_statements(self, threshold: int) -> list:
+        """
+        Statements issued at least `threshold` times, suspected N+1 queries.
+        """
+        by_statement = {}
+        for statement, parameters, seconds in self.statements:
+            entry = by_statement.setdefault(statement, {'count': 0, 'parameters': set(), 'seconds': 0.0})
+            entry['count'] += 1
+            entry['parameters'].add(parameters)
+            entry['seconds'] += seconds
+        return [{'statement': statement, 'count': entry['count'],
+                 'distinct_parameters': len(entry['parameters']), 'seconds': entry['seconds']}
+                for statement, entry in by_statement.items() if entry['count'] >= threshold]
+
+    def report(self, top: int, threshold: int) -> dict:
+        return {
+            'method': request.method,
+            'path': request.full_path,
+            'duration_ms': self.duration * 1000,
+            'samples': self.sampler.samples,
+            'top_functions': self.sampler.top(top),
+            'sql_statements': len(self.statements),
+            'sql_seconds': sum(seconds for _, _, seconds in self.statements),
+            'suspected_n_plus_one': self.repeated_statements(threshold),
+            'statements': [{'statement': statement, 'parameters': parameters, 'seconds': seconds}
+                           for statement, parameters, seconds in self.statements]
+        }
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'profile', None) is not None:
+        conn.info.setdefault('profiling_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, 'profile', None)
+    started = conn.info.get('profiling_started')
+    if profile is not None and started:
+        profile.record_statement(statement, parameters, time.perf_counter() - started.pop())
+
+
+def requested(app: Flask) -> bool:
+    if not app.config['PROFILING_ENABLED'] or not app.config['PROFILING_TOKEN']:
+        return False
+    token = request.headers.get('X-Profile') or request.args.get('profile')
+    return token is not None and hmac.compare_digest(token, app.config['PROFILING_TOKEN'])
+
+
+def init_app(app: Flask):
+    app.config.setdefault('PROFILING_ENABLED', os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('PROFILING_TOKEN', os.getenv('PROFILING_TOKEN', ''))
+    app.config.setdefault('PROFILE_DIR', os.getenv('PROFILE_DIR', '/tmp/profiles'))
+    app.config.setdefault('PROFILING_INTERVAL', float(os.getenv('PROFILING_INTERVAL', 0.001)))
+    app.config.setdefault('PROFILING_REPEATED_THRESHOLD', int(os.getenv('PROFILING_REPEATED_THRESHOLD', 3)))
+
+    @app.before_request
+    def start_profile():
+        if requested(app):
+            g.profile = _local.profile = Profile(app.config['PROFILING_INTERVAL'])
+
+    @app.after_request
+    def stop_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        _local.profile = None
+        profile.stop()
+
+        report = profile.report(top=20, threshold=app.config['PROFILING_REPEATED_THRESHOLD'])
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        path = os.path.join(app.config['PROFILE_DIR'],
+                            f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint}-{threading.get_ident()}.json")
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        response.headers['X-Profile-File'] = path
+        response.headers['X-Profile-Summary'] = (
+            f"duration_ms={report['duration_ms']:.2f}; samples={report['samples']}; "
+            f"sql_statements={report['sql_statements']}; sql_ms={report['sql_seconds'] * 1000:.2f}; "
+            f"suspected_n_plus_one={len(report['suspected_n_plus_one'])}")
+        return response
+
+    @app.teardown_request
+    def discard_profile(exc):
+        # after_request doesn't run when the view raises
+        profile = g.pop('profile', None)
+        if profile is not None:
+            _local.profile = None
+            profile.stop()
@@ -0,0 +1,146 @@
+"""
+HTTP client for the projects module.
+"""
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectsUnavailable(Exception):
+    """
+    The projects module can't be reached, or its circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Consecutive failures circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls fail fast. Once `reset_timeout` seconds have passed one trial call
+    is let through (half open), its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error('projects module circuit opened after %s failures', self.failures)
+                self.opened_at = time.monotonic()
+
+
+class ProjectsClient:
+    """
+    Pooled, keep-alive client for the projects module API.
+
+    GETs are retried with exponential backoff on connection errors and
+    502/503/504 responses. Every call has connect and read timeouts and
+    goes through a circuit breaker, so a projects module that is down
+    fails fast with ProjectsUnavailable.
+
+    observer: optional callback called with (method, outcome, seconds) after
+              each call, outcome is ok, error (5xx), unavailable or circuit_open
+    """
+
+    def __init__(self, api_url: str, pool_size: int = 10, connect_timeout: float = 2,
+                 read_timeout: float = 10, retries: int = 3, backoff_factor: float = 0.3,
+                 failure_threshold: int = 5, reset_timeout: float = 30, observer=None):
+        self.api_url = api_url
+        self.observer = observer
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def observe(self, method: str, outcome: str, started: float):
+        if self.observer is not None:
+            self.observer(method, outcome, time.perf_counter() - started)
+
+    def request(self, method: str, project_id, token: str, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        if not self.breaker.allow():
+            self.observe(method, 'circuit_open', started)
+            raise ProjectsUnavailable('projects module circuit is open')
+
+        try:
+            rv = self.session.request(method, f'{self.api_url}{project_id}',
+                                      headers={'Authorization': token},
+                                      timeout=self.timeout, **kwargs)
+        except requests.RequestException as exp:
+            self.breaker.record_failure()
+            self.observe(method, 'unavailable', started)
+            raise ProjectsUnavailable(f'Cannot connect to the projects module: {exp}') from exp
+
+        if rv.status_code >= 500:
+            self.breaker.record_failure()
+            self.observe(method, 'error', started)
+        else:
+            self.breaker.record_success()
+            self.observe(method, 'ok', started)
+        return rv
+
+    def get_project(self, project_id, token: str):
+        """
+        Get a project
+        return: project dict, None if it doesn't exist
+        """
+        rv = self.request('GET', project_id, token)
+        if rv.status_code == 404:
+            return None
+        if rv.status_code >= 500:
+            raise ProjectsUnavailable(f'projects module answered {rv.status_code}')
+        return rv.json()
+
+    def update_project(self, project_id, data: dict, token: str):
+        """
+        Update a project
+        return: updated project dict, None if it can't be updated (doesn't exist, refused)
+        raises ProjectsUnavailable on 5xx answers, worth retrying later
+        """
+        rv = self.request('PUT', project_id, token, json=data)
+        if rv.status_code == 200:
+            return rv.json()
+        if rv.status_code >= 500:
+            raise ProjectsUnavailable(f'projects module answered {rv.status_code}')
+        return None
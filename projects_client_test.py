@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from projects_client import ProjectsClient, ProjectsUnavailable
+
+
+class StubProjectsHandler(BaseHTTPRequestHandler):
+    """
+    Projects module stub, answers with the statuses queued in server.statuses
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self, body: dict):
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        time.sleep(self.server.delay)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.requests.append((self.command, self.path, self.client_address[1]))
+
+    def do_GET(self):
+        self.answer({'id': int(self.path.rsplit('/', 1)[1]), 'time_gen_id': 1})
+
+    def do_PUT(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.answer(dict(data, id=int(self.path.rsplit('/', 1)[1])))
+
+    def log_message(self, *args):
+        pass
+
+
+class ProjectsClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubProjectsHandler)
+        self.server.statuses = []
+        self.server.requests = []
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = ProjectsClient(f'http://127.0.0.1:{self.server.server_port}/api/projects/',
+                                     read_timeout=0.5, backoff_factor=0,
+                                     failure_threshold=2, reset_timeout=60)
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_and_update(self):
+        self.assertEqual({'id': 1, 'time_gen_id': 1}, self.client.get_project(1, 'Bearer token'))
+        self.assertEqual({'id': 1, 'time_gen_id': 2},
+                         self.client.update_project(1, {'time_gen_id': 2}, 'Bearer token'))
+        self.assertEqual(('GET', '/api/projects/1'), self.server.requests[0][:2])
+        # Keep alive, both requests use the same connection
+        self.assertEqual(self.server.requests[0][2], self.server.requests[1][2])
+
+    def test_not_found(self):
+        self.server.statuses = [404]
+        self.assertIsNone(self.client.get_project(1, 'Bearer token'))
+
+    def test_get_retries(self):
+        self.server.statuses = [503, 503]
+        self.assertEqual(1, self.client.get_project(1, 'Bearer token')['id'])
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_put_not_retried(self):
+        self.server.statuses = [503]
+        with self.assertRaises(ProjectsUnavailable):
+            self.client.update_project(1, {}, 'Bearer token')
+        self.assertEqual(1, len(self.server.requests))
+
+        self.server.statuses = [404]
+        self.assertIsNone(self.client.update_project(1, {}, 'Bearer token'))
+
+    def test_circuit_breaker(self):
+        self.server.delay = 1
+        for _ in range(2):
+            with self.assertRaises(ProjectsUnavailable):
+                self.client.update_project(1, {}, 'Bearer token')
+        self.assertTrue(self.client.breaker.is_open)
+
+        self.server.delay = 0
+        with self.assertRaises(ProjectsUnavailable):
+            self.client.get_project(1, 'Bearer token')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import importlib.util
+import unittest
+import loadtest
+
+
+@unittest.skipUnless(importlib.util.find_spec('gunicorn') and importlib.util.find_spec('gevent'),
+                     'gunicorn and gevent are required')
+class ServingTestCase(unittest.TestCase):
+    def test_gevent_worker_concurrency(self):
+        # One worker keeps many requests waiting on the projects module at once
+        result = loadtest.run('gevent', workers=1, requests_count=40, delay=1.0, port=8097)
+        self.assertEqual(result['errors'], 0)
+        self.assertGreater(result['concurrency'], 8)
+
+    def test_sync_worker_concurrency(self):
+        # A sync worker serves one request at a time
+        result = loadtest.run('sync', workers=1, requests_count=4, delay=0.25, port=8098)
+        self.assertEqual(result['errors'], 0)
+        self.assertLess(result['concurrency'], 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()